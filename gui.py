@@ -1,4 +1,4 @@
-import argparse
+import functools
 import json
 import logging
 import os
@@ -6,14 +6,12 @@ import pickle
 import re
 import threading
 from os.path import exists, isfile
-from sys import stdout
+from typing import Callable
 
 import customtkinter as ctk
-from PIL import Image
-from requests import get
 
 import ui_helpers
-from kademlia_dht import dht, id, networking, protocols, node, contact, storage, routers, errors, helpers, pickler
+from kademlia_dht import dht, id, networking, protocols, contact, errors
 from kademlia_dht.constants import Constants
 from kademlia_dht.errors import IDMismatchError
 
@@ -44,14 +42,23 @@ logger: logging.Logger = ui_helpers.create_logger(verbose)
 
 
 class Fonts:
-    title_font = ("Segoe UI", 20, "bold")
-    text_font = ("Segoe UI", 16)
+    """
+    Shared fonts, these are made once by MainGUI (a Tk root has to exist first) and reused by every widget.
+    """
+    title_font: ctk.CTkFont | None = None
+    text_font: ctk.CTkFont | None = None
+
+    @classmethod
+    def load(cls):
+        cls.title_font = ctk.CTkFont(family="Segoe UI", size=20, weight="bold")
+        cls.text_font = ctk.CTkFont(family="Segoe UI", size=16)
 
 
-class ContactViewer(ctk.CTk):
-    def __init__(self, id: int, protocol_type: type, url: str, port: int, appearance_mode="dark"):
-        super().__init__()
-        ctk.set_appearance_mode(appearance_mode)
+class ContactViewer(ctk.CTkToplevel):
+    def __init__(self, master, id: int, protocol_type: type, url: str, port: int):
+        super().__init__(master)
+        self.transient(master)  # Keep above, and minimise with, the main window.
+        self.master: MainGUI
 
         self.id = id
         self.url = url
@@ -77,12 +84,6 @@ class ContactViewer(ctk.CTk):
                                            command=self.export_contact)
         self.export_button.pack(padx=20, pady=10)
 
-    def show_error(self, error_message: str):
-        logger.error(f"[Error] {error_message}")
-
-        error_window = ErrorWindow(error_message)
-        error_window.mainloop()
-
     def export_contact(self, filename="our_contact.json"):
         contact_dict = {
             "url": self.url,
@@ -92,30 +93,41 @@ class ContactViewer(ctk.CTk):
         }
         logger.info(f"Exporting our contact...")
         with open(filename, "w") as f:
-            json.dump(contact_dict, f)
-        self.show_status(f"Exported our contact to {filename}.")
+            json.dump(contact_dict, f, separators=(",", ":"))
+        self.master.show_status(f"Exported our contact to {filename}.")
 
-    def show_status(self, message: str):
-        logger.info(message)
-        status_window = StatusWindow(message)
-        status_window.mainloop()
 
-
-class StatusWindow(ctk.CTk):
-    def __init__(self, message: str, copy_data=None):
+class StatusWindow(ctk.CTkToplevel):
+    def __init__(self, master, message: str, copy_data=None):
         """
         Creates the status window, with option for copying data to clipboard if there is copy data.
+        :param master: Root window, this is pumped by its mainloop.
         :param message:
         :param copy_data:
         """
-        ctk.CTk.__init__(self)
-        self.copy_data = copy_data
-        self.message = ctk.CTkLabel(self, text=message, font=Fonts.text_font)
+        ctk.CTkToplevel.__init__(self, master)
+        self.transient(master)
+        # This window is reused by MainGUI.show_status, so closing it only hides it.
+        self.protocol("WM_DELETE_WINDOW", self.withdraw)
+        self.copy_data = None
+        self.message = ctk.CTkLabel(self, text="", font=Fonts.text_font)
         self.message.pack(padx=30, pady=20)
         self.copy_button = ctk.CTkButton(self, text="Copy to clipboard", font=Fonts.text_font,
                                          command=self.copy)
+        self.set_text(message, copy_data)
+
+    def set_text(self, message: str, copy_data=None):
+        """
+        Changes the message shown, and shows the copy button only if there is copy data.
+        :param message:
+        :param copy_data:
+        """
+        self.message.configure(text=message)
+        self.copy_data = copy_data
         if copy_data:
             self.copy_button.pack(padx=30, pady=20)
+        else:
+            self.copy_button.pack_forget()
 
     def copy(self):
         logger.info(f"Copying data to clipboard: {self.copy_data}")
@@ -124,12 +136,11 @@ class StatusWindow(ctk.CTk):
         self.update()
 
 
-class Settings(ctk.CTk):
-    def __init__(self, hash_table: dht.DHT | None, appearance_mode="dark"):
-        super().__init__()
-        ctk.set_appearance_mode(appearance_mode)
-
-        self.appearance_mode = appearance_mode
+class Settings(ctk.CTkToplevel):
+    def __init__(self, master, hash_table: dht.DHT | None):
+        super().__init__(master)
+        self.transient(master)
+        self.master: MainGUI
 
         self.dht: dht.DHT | None = hash_table
 
@@ -144,7 +155,7 @@ class Settings(ctk.CTk):
 
             self.dht_export_file = ctk.CTkEntry(self, width=200, height=20, font=Fonts.text_font)
             self.dht_export_file.grid(column=1, row=1, padx=10, pady=10)
-            self.dht_export_file.insert("1", f"dht.pickle")
+            self.dht_export_file.insert(0, "dht.pickle")
             self.export_dht_button = ctk.CTkButton(self, text="Export/Save DHT", font=Fonts.text_font,
                                                    command=self.export_dht)
             self.export_dht_button.grid(column=1, row=2, padx=10, pady=10)
@@ -157,23 +168,13 @@ class Settings(ctk.CTk):
                                         text="You have not made a DHT yet! You should not be able to access this.")
             no_dht_label.grid(column=0, row=1, padx=10, pady=10)
 
-    def show_error(self, error_message: str):
-        logger.error(error_message)
-        error_window = ErrorWindow(error_message)
-        error_window.mainloop()
-
-    def show_status(self, message: str):
-        logger.info(message)
-        status_window = StatusWindow(message)
-        status_window.mainloop()
-
     def export_dht(self):
-        try:
-            file = self.dht_export_file.get().strip("\n")
-            self.dht.save(file)
-            self.show_status(f"File saved successfully to {file}.")
-        except Exception as e:
-            self.show_error(str(e))
+        file = self.dht_export_file.get()
+        # Saving can take a while with a big DHT, so keep it off the Tk thread.
+        self.master.run_in_background(
+            functools.partial(self.dht.save, file),
+            on_done=lambda _: self.master.show_status(f"File saved successfully to {file}.")
+        )
 
     def view_contact(self):
         our_contact: contact.Contact = self.dht.our_contact
@@ -184,30 +185,39 @@ class Settings(ctk.CTk):
         our_ip_address: str = protocol.url
         our_port: int = protocol.port
 
-        contact_viewer = ContactViewer(
+        ContactViewer(
+            self.master,
             id=our_id,
             protocol_type=protocol_type,
             url=our_ip_address,
-            port=our_port,
-            appearance_mode=self.appearance_mode
+            port=our_port
         )
-        contact_viewer.mainloop()
 
 
-class ErrorWindow(ctk.CTk):
-    def __init__(self, error_message: str):
-        super().__init__()
-        self.title = ctk.CTkLabel(self, text="Error", font=Fonts.title_font)
-        self.title.pack(padx=20, pady=20)
+class ErrorWindow(ctk.CTkToplevel):
+    def __init__(self, master, error_message: str):
+        super().__init__(master)
+        self.transient(master)
+        self.title("Error")
+        # This window is reused by MainGUI.show_error, so closing it only hides it.
+        self.protocol("WM_DELETE_WINDOW", self.withdraw)
+        self.error_title = ctk.CTkLabel(self, text="Error", font=Fonts.title_font)
+        self.error_title.pack(padx=20, pady=20)
 
         self.error_message = ctk.CTkLabel(self, text=error_message, font=Fonts.text_font)
         self.error_message.pack(padx=20, pady=10)
 
+    def set_text(self, error_message: str):
+        self.error_message.configure(text=error_message)
+
 
 class MainGUI(ctk.CTk):
     def __init__(self, appearance_mode="dark"):
         ctk.CTk.__init__(self)
+        Fonts.load()
         self.settings_button = None
+        self.error_window: ErrorWindow | None = None
+        self.status_window: StatusWindow | None = None
         self.appearance_mode = appearance_mode
         ctk.set_appearance_mode(appearance_mode)
         # self.geometry("600x500")
@@ -233,42 +243,69 @@ class MainGUI(ctk.CTk):
 
         Now we have initialised Kademlia, the main network frame is launched.
 
+        This is all done on a separate thread, so the window doesn't freeze while waiting on ipify.
+
         :return:
         """
-        self.dht, self.server, self.server_thread = ui_helpers.initialise_kademlia(USE_GLOBAL_IP, PORT, logger=logger)
+        self.run_in_background(
+            lambda: ui_helpers.initialise_kademlia(USE_GLOBAL_IP, PORT, logger=logger),
+            on_done=self._on_kademlia_initialised
+        )
 
+    def _on_kademlia_initialised(self, initialised: tuple[dht.DHT, networking.TCPServer, threading.Thread]):
+        self.dht, self.server, self.server_thread = initialised
         self.make_network_frame()
 
+    def run_in_background(self, work: Callable[[], object], *, on_done: Callable | None = None,
+                          on_error: Callable[[Exception], None] | None = None) -> None:
+        """
+        Runs work() on a daemon thread, so RPCs and other slow calls don't freeze the window.
+        work takes no arguments, use a lambda or functools.partial to pass it any.
+        on_done(result) or on_error(exception) is then called back on the Tk thread with self.after(),
+        if on_error is not given the exception is shown in an error window.
+        """
+        def worker():
+            try:
+                result = work()
+            except Exception as e:
+                self.after(0, on_error if on_error else lambda error: self.show_error(str(error)), e)
+                return
+            if on_done:
+                self.after(0, on_done, result)
+
+        threading.Thread(target=worker, daemon=True).start()
+
     def open_settings(self):
         if hasattr(self, "dht"):
-            settings_window = Settings(hash_table=self.dht, appearance_mode=self.appearance_mode)
-            settings_window.mainloop()
-        else:
-            pass
+            Settings(self, hash_table=self.dht)
 
-    def thread_open_settings(self):
+    @staticmethod
+    @functools.lru_cache(maxsize=1)
+    def settings_icon() -> ctk.CTkImage:
         """
-        OBSELETE - open_settings works fine.
-        Opens the server window in a thread - this is not recommended to use.
-        :return:
+        Returns the settings icon, this is only decoded the first time, not on every frame switch.
         """
-        settings_thread = threading.Thread(target=self.open_settings, daemon=True)
-        settings_thread.daemon = True  # Dies when program ends.
-        settings_thread.start()
-
-    def add_settings_icon(self):
+        from PIL import Image  # Only needed once there is a window to draw on.
         dark_icon = Image.open(r"assets/settings_icon_light.png")
         light_icon = Image.open(r"assets/settings_icon_dark.png")
-        settings_icon = ctk.CTkImage(light_image=light_icon, dark_image=dark_icon, size=(30, 30))
-        self.settings_button = ctk.CTkButton(self, image=settings_icon, text="",
+        return ctk.CTkImage(light_image=light_icon, dark_image=dark_icon, size=(30, 30))
+
+    def add_settings_icon(self):
+        self.settings_button = ctk.CTkButton(self, image=self.settings_icon(), text="",
                                              bg_color="transparent", fg_color="transparent",
                                              width=28, command=self.open_settings)
 
         self.settings_button.pack(side=ctk.BOTTOM, anchor=ctk.S, padx=10, pady=10)
 
     def clear_screen(self):
-        for child in self.winfo_children():
-            child.destroy()
+        # Stop the window resizing to fit between each destroy, it is laid out once the next frame is packed.
+        self.pack_propagate(False)
+        try:
+            for child in list(self.winfo_children()):
+                if not isinstance(child, ctk.CTkToplevel):  # Leave any open pop-up windows alone.
+                    child.destroy()
+        finally:
+            self.pack_propagate(True)
 
     def clear_screen_and_keep_settings(self):
         self.clear_screen()
@@ -307,17 +344,23 @@ class MainGUI(ctk.CTk):
         network_frame = MainNetworkFrame(self)
         network_frame.pack(padx=20, pady=20)
 
-    @classmethod
-    def show_error(cls, error_message: str):
+    def show_error(self, error_message: str):
         logger.error(error_message)
-        error_window = ErrorWindow(error_message)
-        error_window.mainloop()
+        if self.error_window is None or not self.error_window.winfo_exists():
+            self.error_window = ErrorWindow(self, error_message)
+        else:
+            self.error_window.set_text(error_message)
+            self.error_window.deiconify()
+        self.error_window.lift()
 
-    @classmethod
-    def show_status(cls, message: str, copy_data=None):
+    def show_status(self, message: str, copy_data=None):
         logger.info(message)
-        status_window = StatusWindow(message, copy_data)
-        status_window.mainloop()
+        if self.status_window is None or not self.status_window.winfo_exists():
+            self.status_window = StatusWindow(self, message, copy_data)
+        else:
+            self.status_window.set_text(message, copy_data)
+            self.status_window.deiconify()
+        self.status_window.lift()
 
     def make_download_frame(self):
         self.clear_screen_and_keep_settings()
@@ -368,8 +411,12 @@ class UploadFrame(ctk.CTkFrame):
                 logger.error("File to upload must not be a directory.")
                 self.parent.show_error("Must not be a directory.")
             else:
-                id_to_store_to = ui_helpers.store_file(file_to_upload, self.parent.dht)
-                self.parent.show_status(f"Stored file at {id_to_store_to.value}.", copy_data=str(id_to_store_to.value))
+                # Hashing the file and storing its pieces on the network can take a while, so keep it off the Tk thread.
+                self.parent.run_in_background(
+                    functools.partial(ui_helpers.store_file, file_to_upload, self.parent.dht),
+                    on_done=lambda id_to_store_to: self.parent.show_status(f"Stored file at {id_to_store_to.value}.",
+                                                                           copy_data=str(id_to_store_to.value))
+                )
         else:
             logger.error(f"Path not found: {file_to_upload}")
             self.parent.show_error(f"Path not found: {file_to_upload}")
@@ -409,13 +456,19 @@ class DownloadFrame(ctk.CTkFrame):
             self.parent.show_error("ID out of range.")
         else:
             id_to_download: id.ID = id.ID(int(id_from_entry))
-            try:
-                download_path = ui_helpers.download_file(id_to_download, self.parent.dht)
-                self.parent.show_status(f"File downloaded to {download_path}.")
-            except IDMismatchError:
-                self.parent.show_error("File ID not found on the network.")
-            except Exception as e:
-                self.parent.show_error(str(e))
+
+            def on_error(e: Exception):
+                if isinstance(e, IDMismatchError):
+                    self.parent.show_error("File ID not found on the network.")
+                else:
+                    self.parent.show_error(str(e))
+
+            # Finding the file's pieces is a lookup over the network, so keep it off the Tk thread.
+            self.parent.run_in_background(
+                functools.partial(ui_helpers.download_file, id_to_download, self.parent.dht),
+                on_done=lambda download_path: self.parent.show_status(f"File downloaded to {download_path}."),
+                on_error=on_error
+            )
 
 
 class MainNetworkFrame(ctk.CTkFrame):
@@ -460,7 +513,7 @@ class LoadDHTFromFileFrame(ctk.CTkFrame):
         self.load_button.grid(column=1, row=2, padx=20, pady=0)
 
     def load_dht(self):
-        filename = self.file_name_entry.get().strip("\n")
+        filename = self.file_name_entry.get()
 
         if not isfile(filename):
             self.parent.show_error(f"File not found:\n'{filename}'")
@@ -551,33 +604,17 @@ class BootstrapFromJSONFrame(ctk.CTkFrame):
             with open(filename, "r") as f:
                 contact_dict = json.load(f)
 
-            known_id = None
-            if "id" in contact_dict:
-                known_id = contact_dict["id"]
-            else:
-                self.parent.show_error("File to bootstrap from had no \nparameter 'id'.")
+            missing = [key for key in ("id", "url", "port") if key not in contact_dict]
+            if missing:
+                self.parent.show_error(f"File to bootstrap from had no \nparameter(s) {', '.join(missing)}.")
+                return
 
-            known_url = None
-            if "url" in contact_dict:
-                known_url = contact_dict["url"]
-            else:
-                self.parent.show_error("File to bootstrap from had no \nparameter 'url'.")
-
-            known_port = None
-            if "port" in contact_dict:
-                known_port = contact_dict["port"]
-            else:
-                self.parent.show_error("File to bootstrap from had no \nparameter 'port'.")
-
-            if known_url and known_port and known_url:
-                success_bootstrapping: bool = BootstrapFrame.bootstrap(
-                    parent=self.parent,
-                    known_id=id.ID(known_id),
-                    known_url=known_url,
-                    known_port=known_port
-                )
-                if success_bootstrapping:
-                    self.parent.make_network_frame()
+            BootstrapFrame.bootstrap(
+                parent=self.parent,
+                known_id=id.ID(contact_dict["id"]),
+                known_url=contact_dict["url"],
+                known_port=contact_dict["port"]
+            )
 
 
 class BootstrapFrame(ctk.CTkFrame):
@@ -621,48 +658,52 @@ class BootstrapFrame(ctk.CTkFrame):
         self.connect_button.grid(row=5, column=0, columnspan=2, padx=5, pady=10)
 
     def handle_bootstrap(self):
-        valid = False
-
         known_ip: str = self.ip_entry.get().strip("\n")
         ip_regex = r"(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])"
         if not known_ip:
             self.parent.show_error("IP address must not be empty.")
+            return
         elif not re.match(string=known_ip, pattern=ip_regex):
             self.parent.show_error("IP address is invalid.")
-        else:
-            valid = True
+            return
 
         known_port_str: str = self.port_entry.get().strip("\n")
-        known_port = None
         if not known_port_str:
             self.parent.show_error("Port must not be empty.")
-        elif not known_port_str.isnumeric():
+            return
+        try:
+            known_port = int(known_port_str)
+        except ValueError:
             self.parent.show_error("Port was not a number.")
-        elif int(known_port_str) < 0 or int(known_port_str) > 65535:
+            return
+        if known_port < 0 or known_port > 65535:
             self.parent.show_error("Port was out of range. Must be between 0 and 65535.")
-        else:
-            known_port = int(known_port_str)
-            valid = True
+            return
 
         known_id_value: str = self.id_entry.get().strip("\n")
-        known_id = None
         if not known_id_value:
             self.parent.show_error("ID must not be empty.")
-        elif not known_id_value.isnumeric():
+            return
+        try:
+            known_id_int = int(known_id_value)
+        except ValueError:
             self.parent.show_error("ID was not a number.")
-        elif int(known_id_value) < 0 or int(known_id_value) >= 2 ** Constants.ID_LENGTH_BITS:
+            return
+        if known_id_int < 0 or known_id_int >= 2 ** Constants.ID_LENGTH_BITS:
             # what if they want to change ID range?
             self.parent.show_error("ID out of range")
-        else:
-            known_id = id.ID(int(known_id_value))
-            valid = True
+            return
+        known_id = id.ID(known_id_int)
 
-        if known_id and known_ip and known_port and valid:
-            self.bootstrap(self.parent, known_id, known_ip, known_port)
+        self.bootstrap(self.parent, known_id, known_ip, known_port)
 
     @classmethod
-    def bootstrap(cls, parent: MainGUI, known_id: id.ID, known_url: str, known_port: int) -> bool:
-        """Attempts to bootstrap Kademlia connection from a known contact"""
+    def bootstrap(cls, parent: MainGUI, known_id: id.ID, known_url: str, known_port: int) -> None:
+        """
+        Attempts to bootstrap Kademlia connection from a known contact.
+        The bootstrap is a lookup over the network, so it is ran with parent.run_in_background(),
+        the main network frame is opened once it has succeeded.
+        """
         known_protocol = protocols.TCPProtocol(
             url=known_url, port=known_port
         )
@@ -674,30 +715,28 @@ class BootstrapFrame(ctk.CTkFrame):
         logger.debug("Bootstrapping from known contact")
         if not hasattr(parent, "dht"):
             parent.initialise_kademlia()
-            return True
+            return
 
-        logger.info("Attempting to connect to known peer's network...")
-        try:
-            parent.dht.bootstrap(known_contact)
+        def on_connected(_):
             logger.info("Connected to known peer's network.")
-            return True
-
-        except errors.RPCError as e:
-            if e.timeout_error:
-                parent.show_error("Timeout error trying to contact known peer.")
-                return False
-            elif e.id_mismatch_error:
-                parent.show_error("Random ID returned does not match what was sent.")
-                return False
-            elif e.peer_error:
-                parent.show_error(f"Peer error: {e}")
-                return False
-            elif e.protocol_error:
-                parent.show_error(f"Protocol error: {e}")
-                return False
-        except Exception as e:
-            parent.show_error(str(e))
-            return False
+            parent.make_network_frame()
+
+        def on_error(e: Exception):
+            if isinstance(e, errors.RPCError):
+                if e.timeout_error:
+                    parent.show_error("Timeout error trying to contact known peer.")
+                elif e.id_mismatch_error:
+                    parent.show_error("Random ID returned does not match what was sent.")
+                elif e.peer_error:
+                    parent.show_error(f"Peer error: {e}")
+                elif e.protocol_error:
+                    parent.show_error(f"Protocol error: {e}")
+            else:
+                parent.show_error(str(e))
+
+        logger.info("Attempting to connect to known peer's network...")
+        parent.run_in_background(functools.partial(parent.dht.bootstrap, known_contact),
+                                 on_done=on_connected, on_error=on_error)
 
 
 if __name__ == "__main__":
@@ -57,11 +57,13 @@ class KBucket:
 
     def is_in_range(self, other_id: ID) -> bool:
         """
-        Determines if a given ID is within the range of the k-bucket.
+        Determines if a given ID is within the range of the k-bucket, [low, high).
+        high is left out, as it is the low of the next k-bucket, so an ID on a split's midpoint
+        is only in range of the upper k-bucket, which is the one split() puts it in.
         :param other_id: The ID to be checked.
         :return: Boolean saying if it's in the range of the k-bucket.
         """
-        return self._low <= other_id.value <= self._high
+        return self._low <= other_id.value < self._high
 
     def add_contact(self, contact: Contact) -> None:
         if self.is_full():
@@ -258,12 +260,15 @@ class BucketList:
 
     def get_close_contacts(self, key: ID, exclude: ID) -> list[Contact]:
         """
-        Brute force distance lookup of all known contacts, sorted by distance.
-        Then we take K of the closest.
+        Brute force distance lookup of all known contacts. Returns the K closest, sorted by distance.
+        This is a heap selection, so the contacts further than the closest K are never sorted.
         :param key: The ID for which we want to find close contacts.
         :param exclude: The ID to exclude (the requesters ID).
         :return: List of K contacts sorted by distance.
         """
+        # Imported here as helpers imports node, which imports this module.
+        from kademlia_dht import helpers
+
         # with self.lock:
         contacts = []
         for bucket in self.buckets:
@@ -271,12 +276,8 @@ class BucketList:
 
                 if contact.id != exclude:
                     contacts.append(contact)
-        contacts = sorted(contacts, key=lambda c: c.id ^ key)[:Constants.K]
-        if len(contacts) > Constants.K and Constants.DEBUG:
-            raise ValueError(
-                f"Contacts should be smaller than or equal to K. Has length {len(contacts)}, "
-                f"which is {Constants.K - len(contacts)} too big.")
-        return contacts
+        indices = helpers.k_closest_indices([c.id.value for c in contacts], key.value, Constants.K)
+        return [contacts[i] for i in indices]
 
     def contacts(self) -> list[Contact]:
         """
@@ -289,8 +290,38 @@ class BucketList:
                 contacts.append(contact)
         return contacts
 
+    def contacts_within_distance(self, key: int, distance: int) -> list[int]:
+        """
+        Returns the ID values of all contacts in k-buckets which could hold an ID
+        at most distance away from key (XOR). Other k-buckets are skipped without
+        looking at their contacts.
+
+        K-buckets are only ever split at their midpoint, so each one spans an aligned
+        power of 2 range, [low, low + 2^n). Every ID in that range shares the bits of
+        low above bit n, so the closest any of them can be to key is (low ^ key) with
+        the bottom n bits cleared.
+        :param key: The ID value to measure distance from.
+        :param distance: The largest XOR distance from key we are interested in.
+        :return: ID values of contacts which might be within distance of key.
+        """
+        id_values: list[int] = []
+        for bucket in self.buckets:
+            if bucket.contacts:
+                range_bits: int = (bucket.high() - bucket.low()).bit_length() - 1
+                if ((bucket.low() ^ key) >> range_bits) << range_bits <= distance:
+                    id_values.extend(c.id.value for c in bucket.contacts)
+        return id_values
+
     def contact_exists(self, contact: Contact) -> bool:
-        return contact in self.contacts()
+        """
+        Returns if a contact with the same ID as the given contact is in the bucket list.
+        Only the k-bucket with the contact's ID in range can hold it, so that is the only one checked.
+        K-bucket ranges are half-open, so this is the same k-bucket split() and add_contact() put the ID in,
+        even when it is on a k-bucket boundary.
+        :param contact:
+        :return:
+        """
+        return self.get_kbucket(contact.id).contains(contact.id)
 
     def __repr__(self):
         return f"{[[c.id for c in b.contacts] for b in self.buckets]}"
@@ -1,3 +1,4 @@
+import os
 from dataclasses import dataclass
 
 
@@ -17,6 +18,13 @@ class Constants:
     ID_LENGTH_BYTES = 20
     ID_LENGTH_BITS = ID_LENGTH_BYTES * 8
     MAX_THREADS = 20
+    MAX_SERVER_THREADS = 32  # threads handling incoming RPCs
+    MAX_PROCESSING_REQUESTS = 2 * (os.cpu_count() or 1)  # requests decoding/encoding at once
+    KEEP_ALIVE_TIMEOUT_SEC = 5  # idle kept-alive RPC connections are closed after this
+    KEEP_ALIVE_POLL_SEC = 0.05  # how often idle connections check if their server thread is needed elsewhere
+    LARGE_RESPONSE_BYTES = 64 * 1024  # responses bigger than this bypass the write buffer
+    STORE_MANY_MAX_PAIRS = 64  # most key-values sent in one STORE_MANY request
+    STORE_MANY_MAX_BYTES = 262_144  # most value bytes in one STORE_MANY request, a STORE of a piece is this size
     RESPONSE_WAIT_TIME_MS = 10  # in ms
     BUCKET_REFRESH_INTERVAL_MS = 60 * 60 * 1000  # hourly in ms
     KEY_VALUE_REPUBLISH_INTERVAL_MS = 60 * 60 * 1000  # hourly in ms
@@ -1,4 +1,7 @@
 import logging
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Callable, Optional
 
@@ -18,6 +21,10 @@ from kademlia_dht.routers import BaseRouter
 
 logger = logging.getLogger("__main__")
 
+# Sends the STOREs for a value to its close contacts, A at a time. This is kept out of the DHT,
+# so it isn't pickled by DHT.save(). Its threads are only started when a value is first stored.
+_store_executor = ThreadPoolExecutor(max_workers=Constants.A, thread_name_prefix="kademlia_store")
+
 
 class DHT:
     """
@@ -154,13 +161,24 @@ class DHT:
         dht_id: ID = ID(file_hash)
         dht = cls(dht_id, protocol, router, storage_factory, originator_storage, republish_storage, cache_storage)
         with open(filename, "rb") as file:
-            chunk: bytes = file.read(Constants.PIECE_LENGTH)
-
-            while chunk:
-                key: ID = ID(helpers.get_sha1_hash(chunk))
-                value: str = chunk.decode(Constants.PICKLE_ENCODING)
-                dht.store(key, value)
-                chunk = file.read(Constants.PIECE_LENGTH)
+            size: int = os.fstat(file.fileno()).st_size
+            if size == 0:  # mmap cannot map an empty file.
+                return dht
+            # Pieces are hashed as slices of the mapped file, rather than each being read into a new bytes object,
+            # the only copy of a piece is the str that is stored.
+            # Looked up once, rather than for every piece.
+            piece_length: int = Constants.PIECE_LENGTH
+            encoding: str = Constants.PICKLE_ENCODING
+            get_sha1_hash: Callable[[memoryview], int] = helpers.get_sha1_hash
+            # Every piece is stored, so the originator storage file (if there is one) is written once at the end.
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file, \
+                    dht._originator_storage.batch():
+                with memoryview(mapped_file) as view:
+                    for start in range(0, size, piece_length):
+                        with view[start:start + piece_length] as piece:
+                            key: ID = ID(get_sha1_hash(piece))
+                            value: str = str(piece, encoding)
+                        dht.store(key, value)
 
         return dht
 
@@ -259,9 +277,11 @@ class DHT:
             contacts: list[Contact] = self._router.lookup(
                 key, self._router.rpc_find_nodes)["contacts"]
 
-        for c in contacts:
-            error: RPCError | None = c.protocol.store(
-                sender=self.node.our_contact, key=key, val=val)
+        # Each STORE is a round trip, so they are all sent at once rather than waiting on each in turn.
+        # Errors are handled here, after they have all returned, as handling them isn't thread safe.
+        errors: list[RPCError | None] = list(_store_executor.map(
+            lambda c: c.protocol.store(sender=self.node.our_contact, key=key, val=val), contacts))
+        for c, error in zip(contacts, errors):
             self.handle_error(error, c)
 
     def bootstrap(self, known_peer: Contact) -> None:
@@ -379,11 +399,13 @@ class DHT:
             Constants.KEY_VALUE_REPUBLISH_INTERVAL_MS
         ]
 
-        for k in rep_keys:
-            key: ID = ID(k)
-            self.store_on_closer_contacts(key,
-                                          self._republish_storage.get(key))
-            self._republish_storage.touch(k)
+        # Every key is touched, so the storage file (if there is one) is written once at the end.
+        with self._republish_storage.batch():
+            for k in rep_keys:
+                key: ID = ID(k)
+                self.store_on_closer_contacts(key,
+                                              self._republish_storage.get(key))
+                self._republish_storage.touch(k)
 
     def _expire_keys_elapsed(self) -> None:
         """
@@ -403,8 +425,9 @@ class DHT:
         ]
 
         # expired is a list of all expired keys in the given storage.
-        for key in expired:
-            store.remove(key)
+        with store.batch():
+            for key in expired:
+                store.remove(key)
 
     def _originator_republish_elapsed(self) -> None:
         """
@@ -428,21 +451,22 @@ class DHT:
                 milliseconds=Constants.ORIGINATOR_REPUBLISH_INTERVAL_MS)
         ]
 
-        for k in keys_pending_republish:
-            key: ID = k
-            # Just use close contacts, don't do a lookup
-            contacts = self.node.bucket_list.get_close_contacts(
-                key, self.node.our_contact.id)
+        with self._originator_storage.batch():
+            for k in keys_pending_republish:
+                key: ID = k
+                # Just use close contacts, don't do a lookup
+                contacts = self.node.bucket_list.get_close_contacts(
+                    key, self.node.our_contact.id)
 
-            for c in contacts:
-                error: RPCError | None = c.protocol.store(
-                    sender=self.our_contact,
-                    key=key,
-                    val=self._originator_storage.get(key)
-                )
-                self.handle_error(error, c)
+                for c in contacts:
+                    error: RPCError | None = c.protocol.store(
+                        sender=self.our_contact,
+                        key=key,
+                        val=self._originator_storage.get(key)
+                    )
+                    self.handle_error(error, c)
 
-            self._originator_storage.touch(k.value)
+                self._originator_storage.touch(k.value)
 
     def _get_separating_nodes_count(self, contact_a: Contact, contact_b: Contact) -> int:
         """
@@ -489,7 +513,9 @@ class DHT:
         # Non-concurrent list needs locking
         # lock(pending_contacts)
         # add only if it's a new pending contact.
-        if to_replace.id not in [c.id for c in self.pending_contacts]:
+        # Compares ID values, rather than building a list of the pending contacts' IDs.
+        to_replace_id_value: int = to_replace.id.value
+        if not any(c.id.value == to_replace_id_value for c in self.pending_contacts):
             self.pending_contacts.append(to_replace)
 
         key: int = to_evict.id.value
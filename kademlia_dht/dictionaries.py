@@ -1,3 +1,4 @@
+from queue import Queue
 from typing import Callable, TypedDict
 
 from kademlia_dht.contact import Contact
@@ -20,7 +21,7 @@ class ContactQueueItem(TypedDict):
     rpc_call: Callable
     closer_contacts: list[Contact]
     further_contacts: list[Contact]
-    find_result: FindResult
+    result_slot: Queue  # holds at most one FindResult, the first value found
 
 
 class GetCloserNodesReturn(TypedDict):
@@ -54,6 +55,12 @@ class StoreRequest(BaseRequest, TypedDict):
     expiration_time_sec: int
 
 
+class StoreManyRequest(BaseRequest, TypedDict):
+    key_values: list[list[int | str]]  # [key, value] pairs, JSON has no tuples.
+    is_cached: bool
+    expiration_time_sec: int
+
+
 class ITCPSubnet(TypedDict):
     """
     Interface used for TCP Subnetting.
@@ -77,6 +84,10 @@ class StoreSubnetRequest(StoreRequest, ITCPSubnet, TypedDict):
     pass
 
 
+class StoreManySubnetRequest(StoreManyRequest, ITCPSubnet, TypedDict):
+    pass
+
+
 class CommonRequest(TypedDict):
     """
     This includes all possible headers that could be passed.
@@ -86,6 +97,7 @@ class CommonRequest(TypedDict):
     sender: int
     key: int
     value: str | None
+    key_values: list[list[int | str]] | None
     is_cached: bool
     expiration_time_sec: int
 
@@ -129,10 +141,10 @@ class StoreValue(TypedDict):
 
     value: str
 
-    republish_timestamp: datetime
+    republish_timestamp: float (time.time(), older key-value pairs may have an ISO format str)
 
     expiration_time: int
     """
     value: str  # | bytes
-    republish_timestamp: str
+    republish_timestamp: float
     expiration_time: int
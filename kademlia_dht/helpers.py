@@ -1,8 +1,11 @@
+import heapq
 import logging
+import mmap
 import os
 import random
 import socket
 import threading
+from collections import OrderedDict
 from hashlib import sha1
 
 from kademlia_dht.constants import Constants
@@ -31,28 +34,81 @@ def select_random(arr: list, freq: int) -> list:
 
 
 def get_closest_number_index(numbers, target):
-    closest_index = 0
-    closest_difference = abs(numbers[0] - target)
+    """
+    Returns the index of the number closest to target (the first one, if there is a tie).
+    IDs are 160-bit, so this stays with python ints rather than a fixed width array.
+    """
+    return min(range(len(numbers)), key=lambda i: abs(numbers[i] - target))
 
-    for i in range(1, len(numbers)):
-        difference = abs(numbers[i] - target)
-        if difference < closest_difference:
-            closest_difference = difference
-            closest_index = i
 
-    return closest_index
+def k_closest_indices(numbers: list[int], target: int, k: int) -> list[int]:
+    """
+    Returns the indices of the k numbers with the smallest XOR distance to target, closest first.
+    This is a heap selection, so it is O(n log k) rather than sorting every number.
+    :param numbers: ID values to search.
+    :param target: ID value to measure distance to.
+    :param k: Maximum number of indices to return.
+    :return: List of indices into numbers, ordered by distance (ties keep their original order).
+    """
+    return heapq.nsmallest(k, range(len(numbers)), key=lambda i: numbers[i] ^ target)
 
 
-def convert_file_to_key(filename: str) -> ID:
+# Files are hashed through a memory map in slices of this size, this keeps
+# the number of calls into hashlib low without mapping huge files all at once.
+HASH_SLICE_LENGTH = 16 * 1024 * 1024  # 16 MiB
+
+
+def _sha1_file_digest(filename: str) -> bytes:
+    """
+    Returns the raw SHA-1 digest of a file.
+    The file is memory-mapped, so each slice is handed to OpenSSL as one contiguous buffer
+    rather than being copied into lots of small Python bytes objects.
+    """
     sha1_hash = sha1()
     with open(filename, 'rb') as file:
-        while True:
-            data = file.read(4096)  # Read data from the file in chunks
-            if not data:
-                break
-            sha1_hash.update(data)  # Update the hash object with the read data
-    digest = int(sha1_hash.hexdigest(), 16)
-    return ID(digest)
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:  # mmap cannot map an empty file.
+            return sha1_hash.digest()
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+            with memoryview(mapped_file) as view:
+                for start in range(0, size, HASH_SLICE_LENGTH):
+                    sha1_hash.update(view[start:start + HASH_SLICE_LENGTH])
+    return sha1_hash.digest()
+
+
+# Digests of files hashed during this run, keyed on absolute path, least recently used first.
+# An entry is only trusted while the file's inode, size, modification time and change time are all unchanged,
+# ctime is included because copying or syncing a file can set the old mtime back on it, but not the old ctime.
+DIGEST_CACHE_SIZE = 256
+_digest_cache: OrderedDict[str, tuple[tuple[int, int, int, int], bytes]] = OrderedDict()
+_digest_cache_lock = threading.Lock()
+
+
+def _cached_sha1_file_digest(filename: str) -> bytes:
+    """
+    Returns the SHA-1 digest of a file, only re-hashing it if it has changed since we last hashed it.
+    """
+    stat = os.stat(filename)
+    path = os.path.abspath(filename)
+    signature = (stat.st_ino, stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns)
+    with _digest_cache_lock:
+        entry = _digest_cache.get(path)
+        if entry and entry[0] == signature:
+            _digest_cache.move_to_end(path)
+            logger.debug(f"Using cached digest for {path}.")
+            return entry[1]
+
+    digest = _sha1_file_digest(filename)
+    with _digest_cache_lock:
+        _digest_cache[path] = (signature, digest)
+        _digest_cache.move_to_end(path)
+        if len(_digest_cache) > DIGEST_CACHE_SIZE:
+            _digest_cache.popitem(last=False)
+    return digest
+
+
+def convert_file_to_key(filename: str) -> ID:
+    return ID.from_digest(_cached_sha1_file_digest(filename))
 
 
 def make_sure_filepath_exists(filename: str) -> None:
@@ -88,23 +144,41 @@ def port_is_free(port: int) -> bool:
         return False
 
 
+def get_free_port_from_os() -> int:
+    """
+    Asks the OS for a free port on localhost by binding to port 0.
+    The port is released straight away, so another process could take it before we bind to it again.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
 def get_valid_port(default_tried=False,
                    lower_bound=1024, upper_bound=65535) -> int:
     """
     Gets a valid port on localhost.
+    The default port is tried first, then a port picked by the OS. If that is outside the bounds, at most
+    Constants.MAX_PORT_RETRIES ports from a shuffled sample of the range are tried.
     """
     if lower_bound > upper_bound:
         raise ValueError("Port lower bound cannot be greater than port upper bound.")
 
     if not default_tried:
         port = 7124  # Default port I wish to use.
-        default_tried = True
-    else:
-        port = random.randint(lower_bound, upper_bound)
-    if port_is_free(port):
+        if lower_bound <= port <= upper_bound and port_is_free(port):
+            return port
+
+    port = get_free_port_from_os()
+    if lower_bound <= port <= upper_bound:
         return port
-    else:
-        return get_valid_port(default_tried=default_tried)
+
+    port_range = range(lower_bound, upper_bound + 1)
+    for port in random.sample(port_range, min(len(port_range), Constants.MAX_PORT_RETRIES)):
+        if port_is_free(port):
+            return port
+
+    raise OSError(f"No free port found between {lower_bound} and {upper_bound}.")
 
 
 class Timer:
@@ -160,18 +234,10 @@ def get_sha1_hash_from_file(filename) -> int:
     """
     Hash a file using SHA-1 (160-bit hash).
     """
-    sha1_hash = sha1()
-
-    with open(filename, 'rb') as file:
-        chunk = file.read(4096)
-        while chunk:
-            sha1_hash.update(chunk)
-            chunk = file.read(4096)
-
-    return int.from_bytes(sha1_hash.digest(), byteorder='big')
+    return int.from_bytes(_cached_sha1_file_digest(filename), byteorder='big')
 
 
-def get_sha1_hash(input: bytes) -> int:
+def get_sha1_hash(input: bytes | memoryview) -> int:
     sha1_hash = sha1(input)
     return int.from_bytes(sha1_hash.digest(), byteorder='big')
 
@@ -1,3 +1,4 @@
+import os
 import random
 from math import ceil, log
 
@@ -5,6 +6,9 @@ from kademlia_dht.constants import Constants
 
 
 class ID:
+    # The same for every ID, so they are worked out once rather than for each ID that is made.
+    MAX_ID = 2 ** Constants.ID_LENGTH_BITS
+    MIN_ID = 0
 
     def __init__(self, value: int):
         """
@@ -14,8 +18,6 @@ class ID:
             value: (int) ID decimal value
         """
 
-        self.MAX_ID = 2 ** Constants.ID_LENGTH_BITS
-        self.MIN_ID = 0
         if not (self.MAX_ID > value >= self.MIN_ID):  # ID can be 0, this is used in unit tests.
             raise ValueError(
                 f"ID {value} is out of range - must a positive integer less than 2^160."
@@ -123,6 +125,15 @@ class ID:
         """
         return ID(0)
 
+    @classmethod
+    def from_digest(cls, digest: bytes):
+        """
+        Returns the ID for a big-endian digest (e.g. a SHA-1 digest).
+        :param digest: Raw digest bytes.
+        :return: ID with the digest's value.
+        """
+        return cls(int.from_bytes(digest, byteorder='big'))
+
     @classmethod
     def random_id_within_bucket_range(cls, bucket):
         """
@@ -133,7 +144,7 @@ class ID:
         :param bucket: bucket to be searched
         :return: random ID in bucket.
         """
-        return ID(bucket.low() + random.randint(0, bucket.high() - bucket.low()))
+        return ID(bucket.low() + random.randint(0, bucket.high() - bucket.low() - 1))
 
     @classmethod
     def random_id(cls, low=0, high=2 ** 160, seed=None):
@@ -147,7 +158,13 @@ class ID:
 
         If I do though, here's how it would be done:
         - Randomly generate each individual bit, then concatenate.
+
+        Outside of debug mode, an ID over the full ID space is read straight from os.urandom, this is
+        one syscall and isn't predictable from the Mersenne Twister state. In debug mode randint is kept,
+        so seeded unit tests generate the same IDs they always have.
         """
         if seed:
             random.seed(seed)
+        if not Constants.DEBUG and seed is None and low == 0 and high >= 2 ** Constants.ID_LENGTH_BITS - 1:
+            return ID(int.from_bytes(os.urandom(Constants.ID_LENGTH_BYTES), byteorder='big'))
         return ID(random.randint(low, high))
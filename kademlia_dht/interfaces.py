@@ -1,5 +1,7 @@
 from abc import abstractmethod
+from contextlib import contextmanager
 from datetime import datetime
+from typing import Iterator
 
 from kademlia_dht.errors import RPCError
 from kademlia_dht.id import ID
@@ -91,6 +93,15 @@ class IStorage:
         """
         pass
 
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Groups several changes to the storage object together, storage objects kept in a file only write it once,
+        when the outermost batch ends. By default, this does nothing.
+        :return:
+        """
+        yield
+
 
 class IProtocol:
     """
@@ -150,3 +161,25 @@ class IProtocol:
         :return:
         """
         pass
+
+    def store_many(self, sender, key_values: list[tuple[ID, str]],
+                   is_cached: bool = False, exp_time_sec: int = 0) -> RPCError:
+        """
+        Attempts to save several key-value pairs to storage. By default, this sends a STORE for each pair,
+        protocols which can send them all in one request override this. The first error is returned,
+        and if the peer times out, the remaining pairs aren't sent.
+
+        :param sender:
+        :param key_values: (key, value) pairs to be stored.
+        :param is_cached:
+        :param exp_time_sec:
+        :return:
+        """
+        first_error: RPCError | None = None
+        for key, val in key_values:
+            error: RPCError = self.store(sender, key, val, is_cached, exp_time_sec)
+            if error.has_error() and first_error is None:
+                first_error = error
+            if error.timeout_error:
+                break
+        return first_error if first_error else RPCError.no_error()
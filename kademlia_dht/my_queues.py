@@ -1,3 +1,4 @@
+from collections import deque
 from typing import Optional
 
 
@@ -9,7 +10,7 @@ class InfiniteLinearQueue:
         You may ask, what's the point of this? isn't this just a normal list?
         Basically, it is; but you have a dequeue method.
         """
-        self.__items = []
+        self.__items = deque()  # popleft() is O(1), unlike list.pop(0).
 
     def is_empty(self):
         """
@@ -32,7 +33,7 @@ class InfiniteLinearQueue:
         :return:
         """
         if not self.is_empty():
-            return self.__items.pop(0)
+            return self.__items.popleft()
         else:
             return None
 
@@ -1,9 +1,11 @@
 import logging
+import threading
+from collections import OrderedDict
 
 from kademlia_dht.buckets import BucketList
 from kademlia_dht.constants import Constants
 from kademlia_dht.contact import Contact
-from kademlia_dht.dictionaries import CommonRequest
+from kademlia_dht.dictionaries import CommonRequest, ContactResponse
 from kademlia_dht.errors import RPCError, SenderIsSelfError, SendingQueryToSelfError
 from kademlia_dht.id import ID
 from kademlia_dht.interfaces import IProtocol, IStorage
@@ -11,6 +13,9 @@ from kademlia_dht.storage import VirtualStorage
 
 logger = logging.getLogger("__main__")
 
+# How many senders of RPCs have their Contact kept, so it can be reused for their next request.
+SENDER_CONTACT_CACHE_SIZE = 4096
+
 
 class Node:
 
@@ -38,6 +43,34 @@ class Node:
         self.cache_storage: IStorage = cache_storage if cache_storage else VirtualStorage()
         self.dht = None  # This should never be None
         self.bucket_list = BucketList(contact)
+        self._setup_sender_contacts()
+
+    def _setup_sender_contacts(self) -> None:
+        """
+        Contacts made for the senders of RPCs, keyed on their ID and encoded protocol, least recently used first.
+        Peers send us RPCs repeatedly, so their Contact is reused rather than made again for every request.
+        """
+        self._sender_contacts: OrderedDict[tuple, Contact] = OrderedDict()
+        self._sender_contacts_lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        """
+        Locks cannot be pickled, so the sender contacts are left out when the DHT is saved.
+        :return:
+        """
+        state = self.__dict__.copy()
+        state.pop("_sender_contacts", None)
+        state.pop("_sender_contacts_lock", None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        """
+        Restores a saved Node, with no sender contacts.
+        :param state:
+        :return:
+        """
+        self.__dict__.update(state)
+        self._setup_sender_contacts()
 
     def __repr__(self):
         return str({
@@ -93,6 +126,36 @@ class Node:
             self.send_key_values_if_new_contact(sender)
             self.storage.set(key, val, Constants.EXPIRATION_TIME_SEC)
 
+    def store_many(self,
+                   key_values: list[tuple[ID, str]],
+                   sender: Contact,
+                   is_cached: bool = False,
+                   expiration_time_sec: int = 0) -> None:
+        """
+        Stores several key-value pairs sent in one request, the same as store() does for each,
+        except the sender is only added and sent key values once.
+
+        :param key_values: (key, value) pairs to be stored.
+        :param sender:
+        :param is_cached:
+        :param expiration_time_sec:
+        :return:
+        """
+        if sender.id.value == self.our_contact.id.value:
+            raise SenderIsSelfError("Sender should not be ourself.")
+
+        self.bucket_list.add_contact(sender)
+
+        if is_cached:
+            with self.cache_storage.batch():
+                for key, val in key_values:
+                    self.cache_storage.set(key, val, expiration_time_sec)
+        else:
+            self.send_key_values_if_new_contact(sender)
+            with self.storage.batch():
+                for key, val in key_values:
+                    self.storage.set(key, val, Constants.EXPIRATION_TIME_SEC)
+
     def find_node(self, key: ID,
                   sender: Contact) -> tuple[list[Contact], str | None]:
         """
@@ -104,7 +167,7 @@ class Node:
         """
 
         # managing sender
-        if sender.id == self.our_contact.id:
+        if sender.id.value == self.our_contact.id.value:
             raise SendingQueryToSelfError("Sender cannot be ourselves.")
 
         self.send_key_values_if_new_contact(sender)
@@ -122,17 +185,17 @@ class Node:
         our storage (then cache storage), given the key. If it cannot do that, it will return
         K contacts that are closer to the key than it is.
         """
-        if sender.id == self.our_contact.id:
+        if sender.id.value == self.our_contact.id.value:
             raise SendingQueryToSelfError("Sender cannot be ourselves.")
 
         self.send_key_values_if_new_contact(sender)
 
         if self.storage.contains(key):
-            logger.debug(f" Value in self.storage of {self.our_contact.id}.")
+            logger.debug(" Value in self.storage of %s.", self.our_contact.id)
             return None, self.storage.get(key)
         elif self.cache_storage.contains(key):
             if Constants.DEBUG:
-                logger.debug(f"Value in self.cache_storage of {self.our_contact.id}.")
+                logger.debug("Value in self.cache_storage of %s.", self.our_contact.id)
             return None, self.cache_storage.get(key)
         else:
             if Constants.DEBUG:
@@ -156,25 +219,29 @@ class Node:
         """
         if self._is_new_contact(sender):
             # with self.bucket_list.lock:
-            # Clone, so we can release the lock.
-            contacts: list[Contact] = self.bucket_list.contacts()
-            if len(contacts) > 0:
+            if any(bucket.contacts for bucket in self.bucket_list.buckets):
+                our_id_value: int = self.our_contact.id.value
                 # and our distance to the key < any other contact's distance
                 # to the key
+                key_values: list[tuple[ID, str]] = []
                 for k in self.storage.get_keys():
-                    # our minimum distance to the contact.
-                    distance = min([c.id ^ k for c in contacts])
+                    our_distance: int = our_id_value ^ k
+                    # Only k-buckets which could hold a contact at least as close
+                    # as us are checked, usually just the one with k in range.
+                    contact_id_values: list[int] = self.bucket_list.contacts_within_distance(k, our_distance)
                     # If our contact is closer, store the contact on its
-                    # node.
-                    if (self.our_contact.id ^ k) < distance:
-                        logger.debug(f"Protocol used by sender: {sender.protocol}")
-                        error: RPCError | None = sender.protocol.store(
-                            sender=self.our_contact,
-                            key=ID(k),
-                            val=self.storage.get(k)
-                        )
-                        if self.dht:
-                            self.dht.handle_error(error, sender)
+                    # node. This stops at the first contact at least as close as us.
+                    if not any((contact_id_value ^ k) <= our_distance for contact_id_value in contact_id_values):
+                        key_values.append((ID(k), self.storage.get(k)))
+                if key_values:
+                    # All the key-value pairs are sent at once, rather than a STORE round trip each.
+                    logger.debug("Protocol used by sender: %s", sender.protocol)
+                    error: RPCError | None = sender.protocol.store_many(
+                        sender=self.our_contact,
+                        key_values=key_values
+                    )
+                    if self.dht:
+                        self.dht.handle_error(error, sender)
 
     def _is_new_contact(self, sender: Contact) -> bool:
         """
@@ -186,9 +253,10 @@ class Node:
         # with self.bucket_list.lock:
         ret: bool = self.bucket_list.contact_exists(sender)
         # end lock
-        if self.dht:  # might be None in unit testing
+        if self.dht and not ret:  # might be None in unit testing
             # with self.DHT.pending_contacts.lock:
-            ret |= (sender.id in [c.id for c in self.dht.pending_contacts])
+            sender_id_value: int = sender.id.value
+            ret = any(c.id.value == sender_id_value for c in self.dht.pending_contacts)
             # end lock
 
         return not ret
@@ -204,25 +272,48 @@ class Node:
 
     # Server entry points
 
+    def _sender_contact(self, request: CommonRequest) -> Contact:
+        """
+        Returns the Contact for the sender of a request, reusing the one made for their last request
+        if it came with the same protocol. A sender with a new protocol (e.g. a new port) gets a new Contact.
+        :param request:
+        :return:
+        """
+        protocol: IProtocol = request["protocol"]
+        cache_key: tuple = (request["sender"], *protocol.encode().values())
+        with self._sender_contacts_lock:
+            contact: Contact | None = self._sender_contacts.get(cache_key)
+            if contact:
+                self._sender_contacts.move_to_end(cache_key)
+                return contact
+
+        contact = Contact(id=ID(request["sender"]), protocol=protocol)
+        with self._sender_contacts_lock:
+            self._sender_contacts[cache_key] = contact
+            self._sender_contacts.move_to_end(cache_key)
+            if len(self._sender_contacts) > SENDER_CONTACT_CACHE_SIZE:
+                self._sender_contacts.popitem(last=False)
+        return contact
+
+    @staticmethod
+    def _encode_contacts(contacts: list[Contact]) -> list[ContactResponse]:
+        """
+        Returns contacts the way responses send them, their ID value and encoded protocol.
+        JSON cannot handle objects, so protocols are encoded here, in the same pass that builds the list.
+        :param contacts:
+        :return:
+        """
+        return [{"contact": c.id.value, "protocol": c.protocol.encode()} for c in contacts]
+
     def server_ping(self, request: CommonRequest) -> dict:
         logger.info("[Server] Ping called")
-        protocol: IProtocol = request["protocol"]
-        self.ping(
-            Contact(
-                protocol=protocol,
-                id=ID(request["sender"])
-            )
-        )
+        self.ping(self._sender_contact(request))
         return {"random_id": request["random_id"]}
 
     def server_store(self, request: CommonRequest) -> dict:
         logger.info("[Server] Server store called.")
-        protocol: IProtocol = request["protocol"]
         self.store(
-            sender=Contact(
-                id=ID(request["sender"]),
-                protocol=protocol
-            ),
+            sender=self._sender_contact(request),
             key=ID(request["key"]),
             val=str(request["value"]),
             is_cached=request["is_cached"],
@@ -230,47 +321,31 @@ class Node:
         )
         return {"random_id": request["random_id"]}
 
+    def server_store_many(self, request: CommonRequest) -> dict:
+        logger.info("[Server] Server store many called.")
+        self.store_many(
+            sender=self._sender_contact(request),
+            key_values=[(ID(key), str(value)) for key, value in request["key_values"]],
+            is_cached=request["is_cached"],
+            expiration_time_sec=request["expiration_time_sec"]
+        )
+        return {"random_id": request["random_id"]}
+
     def server_find_node(self, request: CommonRequest) -> dict:
         logger.info("[Server] Find node called")
-        protocol: IProtocol = request["protocol"]
-
         contacts, val = self.find_node(
-            sender=Contact(
-                protocol=protocol,
-                id=ID(request["sender"])
-            ),
+            sender=self._sender_contact(request),
             key=ID(request["key"])
         )
 
-        contact_dict: list[dict] = []
-        for c in contacts:
-            contact_info = {
-                "contact": c.id.value,
-                "protocol": c.protocol,
-            }
-
-            contact_dict.append(contact_info)
-
-        return {"contacts": contact_dict, "random_id": request["random_id"]}
+        return {"contacts": self._encode_contacts(contacts), "random_id": request["random_id"]}
 
     def server_find_value(self, request: CommonRequest) -> dict:
         logger.info("[Server] Find Value called")
-        protocol: IProtocol = request["protocol"]
         contacts, val = self.find_value(
-            sender=Contact(
-                protocol=protocol,
-                id=ID(request["sender"])
-            ),
+            sender=self._sender_contact(request),
             key=ID(request["key"])
         )
-        contact_dict: list[dict] = []
-        if contacts:
-            for c in contacts:
-                contact_info = {
-                    "contact": c.id.value,
-                    "protocol": c.protocol,
-                }
-                contact_dict.append(contact_info)
-        return {"contacts": contact_dict,
+        return {"contacts": self._encode_contacts(contacts) if contacts else [],
                 "random_id": request["random_id"],
                 "value": val}
@@ -2,7 +2,6 @@ import json
 import logging
 import pickle
 
-from kademlia_dht.constants import Constants
 from kademlia_dht.errors import DataDecodingError
 
 
@@ -26,7 +25,7 @@ def encode_data(data: dict) -> str:
     The dictionary is then converted to a string using json.dumps()
     """
 
-    return json.dumps(data, cls=Encoder)
+    return json.dumps(data, cls=Encoder, separators=(",", ":"))
 
 
 def decode_data(encoded_data: str | bytes) -> dict:
@@ -47,8 +46,9 @@ def decode_data(encoded_data: str | bytes) -> dict:
     try:
         if isinstance(encoded_data, str):
             decoded_data = json.loads(encoded_data, object_hook=object_hook)
-        elif isinstance(encoded_data, bytes):
-            decoded_data = json.loads(encoded_data.decode(Constants.PICKLE_ENCODING), object_hook=object_hook)
+        elif isinstance(encoded_data, (bytes, bytearray)):
+            # json.dumps only produces ASCII, so json can parse the bytes as they are.
+            decoded_data = json.loads(encoded_data, object_hook=object_hook)
         else:
             raise TypeError(f"Encoded data should be type str, found type {type(encoded_data)}")
 
@@ -1,5 +1,6 @@
 import json
 import logging
+import threading
 
 import requests
 
@@ -8,7 +9,8 @@ from kademlia_dht.constants import Constants
 from kademlia_dht.contact import Contact
 from kademlia_dht.dictionaries import (BaseResponse, ErrorResponse, FindNodeSubnetRequest,
                                        FindValueSubnetRequest, PingSubnetRequest, StoreSubnetRequest, FindNodeRequest,
-                                       FindValueRequest, PingRequest, StoreRequest)
+                                       FindValueRequest, PingRequest, StoreRequest, StoreManyRequest,
+                                       StoreManySubnetRequest)
 from kademlia_dht.errors import RPCError
 from kademlia_dht.id import ID
 from kademlia_dht.interfaces import IProtocol
@@ -21,6 +23,89 @@ from tqdm import tqdm
 logger = logging.getLogger("__main__")
 
 
+_sessions = threading.local()
+
+
+def get_session() -> requests.Session:
+    """
+    Returns this thread's requests session. Sessions pool their connections, so repeated RPCs to the
+    same peer reuse one kept-alive connection. requests.Session isn't thread safe, so each thread
+    (e.g. each ParallelRouter worker) gets its own.
+    """
+    session = getattr(_sessions, "session", None)
+    if session is None:
+        session = _sessions.session = requests.Session()
+    return session
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    """
+    POSTs an RPC with this thread's session. A server closes kept-alive connections when they are idle, it is
+    saturated or it stops, so a pooled connection can be closed just as we reuse it. requests doesn't retry POSTs,
+    that would fail the RPC as a timeout and could get a healthy peer evicted. So a connection error is retried
+    once, the pool has dropped the dead connection by then, so the retry is on a new one.
+    Timeouts aren't retried, an unresponsive peer would otherwise take twice as long to give up on.
+    """
+    session = get_session()
+    try:
+        return session.post(url, **kwargs)
+    except requests.Timeout:  # Includes ConnectTimeout, which is also a ConnectionError.
+        raise
+    except requests.ConnectionError as e:
+        logger.debug("[Client] Retrying RPC on a new connection: %s", e)
+        return session.post(url, **kwargs)
+
+
+def split_key_values(key_values: list[tuple[ID, str]]) -> list[list[tuple[ID, str]]]:
+    """
+    Splits key-values into the batches sent in each STORE_MANY request. A batch has at most STORE_MANY_MAX_PAIRS
+    pairs, and at most STORE_MANY_MAX_BYTES of values (unless a single value is bigger), so a STORE_MANY
+    is about as big as a STORE of one piece, and gets through in the same REQUEST_TIMEOUT_SEC.
+    :param key_values: (key, value) pairs to be stored.
+    :return: list of batches of (key, value) pairs, in the order they were given.
+    """
+    batches: list[list[tuple[ID, str]]] = []
+    batch: list[tuple[ID, str]] = []
+    batch_bytes = 0
+    for key, val in key_values:
+        if batch and (len(batch) >= Constants.STORE_MANY_MAX_PAIRS
+                      or batch_bytes + len(val) > Constants.STORE_MANY_MAX_BYTES):
+            batches.append(batch)
+            batch = []
+            batch_bytes = 0
+        batch.append((key, val))
+        batch_bytes += len(val)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def store_many_in_batches(protocol: "TCPSubnetProtocol | TCPProtocol",
+                          sender: Contact,
+                          key_values: list[tuple[ID, str]],
+                          is_cached: bool,
+                          expiration_time_sec: int) -> RPCError:
+    """
+    Sends key-values with one STORE_MANY request per batch from split_key_values. If the peer doesn't answer
+    a STORE_MANY, the remaining pairs are each sent in a STORE instead, as peers from before STORE_MANY
+    404 the path, or never answer it.
+    :param protocol: Protocol of the peer.
+    :return: The first error.
+    """
+    first_error: RPCError | None = None
+    batches: list[list[tuple[ID, str]]] = split_key_values(key_values)
+    for i, batch in enumerate(batches):
+        error: RPCError | None = protocol._send_store_many(sender, batch, is_cached, expiration_time_sec)
+        if error is None:
+            logger.info("[Client] Peer did not answer STORE_MANY, sending a STORE for each key-value.")
+            remaining: list[tuple[ID, str]] = [key_value for b in batches[i:] for key_value in b]
+            error = IProtocol.store_many(protocol, sender, remaining, is_cached, expiration_time_sec)
+            return first_error if first_error else error
+        if error.has_error() and first_error is None:
+            first_error = error
+    return first_error if first_error else RPCError.no_error()
+
+
 def get_rpc_error(id: ID,
                   ret: BaseResponse | None,
                   timeout_error: bool,
@@ -118,6 +203,21 @@ class VirtualProtocol(IProtocol):
 
         return RPCError.no_error()
 
+    def store_many(self,
+                   sender: Contact,
+                   key_values: list[tuple[ID, str]],
+                   is_cached=False,
+                   exp_time_sec: int = 0) -> RPCError:
+        """
+        Stores all the key-values on the remote peer at once.
+        """
+        self.node.store_many(sender=sender,
+                             key_values=key_values,
+                             is_cached=is_cached,
+                             expiration_time_sec=exp_time_sec)
+
+        return RPCError.no_error()
+
 
 class TCPSubnetProtocol(IProtocol):
 
@@ -170,7 +270,7 @@ class TCPSubnetProtocol(IProtocol):
         error = ""
         try:
             logger.info("[Client] Sending find_node RPC...")
-            ret = requests.post(
+            ret = post(
                 f"http://{self.url}:{self.port}/find_node",
                 data=encoded_data,
                 timeout=Constants.REQUEST_TIMEOUT_SEC
@@ -178,7 +278,7 @@ class TCPSubnetProtocol(IProtocol):
             logger.info(f"[Client] Received HTTP Response from {ret.url} with code {ret.status_code}")
 
         except (requests.Timeout, requests.ConnectionError) as t:
-            logger.error("[Client] Timeout error when contacting node.\n", t)
+            logger.error("[Client] Timeout error when contacting node: %s", t)
             timeout_error = True
             error = t
 
@@ -204,7 +304,7 @@ class TCPSubnetProtocol(IProtocol):
                     rpc_error = get_rpc_error(id,
                                               ret_decoded,
                                               timeout_error,
-                                              ErrorResponse(error_message=str(error), random_id=ID.random_id()))
+                                              ErrorResponse(error_message=str(error), random_id=id.value))
                     if contacts:
                         ret_contacts = [c for c in contacts if c.protocol is not None]
                         return ret_contacts, rpc_error
@@ -212,7 +312,7 @@ class TCPSubnetProtocol(IProtocol):
                 rpc_error = get_rpc_error(id,
                                           ret_decoded,
                                           timeout_error,
-                                          ErrorResponse(error_message=str(error), random_id=ID.random_id()))
+                                          ErrorResponse(error_message=str(error), random_id=id.value))
                 return [], rpc_error
         except Exception as e:
             error = RPCError()
@@ -256,7 +356,7 @@ class TCPSubnetProtocol(IProtocol):
         ret = None
         try:
             logger.debug("[Client] Sending POST")
-            ret = requests.post(
+            ret = post(
                 url=f"http://{self.url}:{self.port}/find_value",
                 data=encoded_data,
                 timeout=Constants.REQUEST_TIMEOUT_SEC,
@@ -348,7 +448,7 @@ class TCPSubnetProtocol(IProtocol):
         ret = None
         try:
             logger.info("[Client] Sending Ping RPC...")
-            ret: requests.Response = requests.post(
+            ret: requests.Response = post(
                 url=f"http://{self.url}:{self.port}/ping",
                 data=encoded_data,
                 timeout=Constants.REQUEST_TIMEOUT_SEC
@@ -356,7 +456,7 @@ class TCPSubnetProtocol(IProtocol):
             logger.info(f"[Client] Received PING response from {ret.url} with code {ret.status_code}")
 
         except (requests.Timeout, requests.ConnectionError) as t:
-            logger.error("[Client] Ping timeout error: ", t)
+            logger.error("[Client] Ping timeout error: %s", t)
             timeout_error = True
             error = t
 
@@ -374,7 +474,7 @@ class TCPSubnetProtocol(IProtocol):
             formatted_response = json.loads(encoded_data)
 
         return get_rpc_error(random_id, formatted_response, timeout_error, ErrorResponse(
-            error_message=str(error), random_id=ID.random_id()))
+            error_message=str(error), random_id=random_id.value))
 
     def store(self,
               sender: Contact,
@@ -402,7 +502,7 @@ class TCPSubnetProtocol(IProtocol):
 
         try:
             logger.info(f"[Client] Sending STORE to http://{self.url}:{self.port}/store")
-            ret = requests.post(
+            ret = post(
                 url=f"http://{self.url}:{self.port}/store",
                 data=encoded_data,
                 timeout=Constants.REQUEST_TIMEOUT_SEC
@@ -426,7 +526,76 @@ class TCPSubnetProtocol(IProtocol):
             formatted_response = json.loads(encoded_data)
 
         return get_rpc_error(random_id, formatted_response, timeout_error, ErrorResponse(
-            error_message=str(error), random_id=ID.random_id()))
+            error_message=str(error), random_id=random_id.value))
+
+    def store_many(self,
+                   sender: Contact,
+                   key_values: list[tuple[ID, str]],
+                   is_cached=False,
+                   expiration_time_sec=0
+                   ) -> RPCError:
+        """
+        Sends the key-value pairs in STORE_MANY requests, rather than a STORE request each.
+        Peers which don't answer /store_many are sent a STORE for each pair instead.
+        """
+        return store_many_in_batches(self, sender, key_values, is_cached, expiration_time_sec)
+
+    def _send_store_many(self,
+                         sender: Contact,
+                         key_values: list[tuple[ID, str]],
+                         is_cached: bool,
+                         expiration_time_sec: int
+                         ) -> RPCError | None:
+        """
+        Sends one STORE_MANY request.
+        :return: The error, or None if the peer didn't answer it (timed out, or 404 for an unknown path).
+        """
+        random_id = ID.random_id()
+
+        encoded_data = encode_data(
+            dict(StoreManySubnetRequest(
+                protocol=sender.protocol.encode(),
+                subnet=self.subnet,
+                sender=sender.id.value,
+                key_values=[[key.value, val] for key, val in key_values],
+                is_cached=is_cached,
+                expiration_time_sec=expiration_time_sec,
+                random_id=random_id.value)))
+
+        timeout_error = False
+        error = None
+        ret = None
+
+        try:
+            logger.info(f"[Client] Sending STORE_MANY to http://{self.url}:{self.port}/store_many")
+            ret = post(
+                url=f"http://{self.url}:{self.port}/store_many",
+                data=encoded_data,
+                timeout=Constants.REQUEST_TIMEOUT_SEC
+            )
+            logger.info(f"[Client] Received STORE_MANY response from {ret.url} with code {ret.status_code}")
+
+        except (requests.Timeout, requests.ConnectionError) as t:
+            logger.error("[Client] Timeout error when contacting node.")
+            timeout_error = True
+            error = t
+
+        except Exception as e:
+            logger.error(f"Exception while trying to store many: {e}")
+            # request timed out.
+            timeout_error = False
+            error = e
+
+        if timeout_error or (ret is not None and ret.status_code == 404):
+            return None
+
+        formatted_response = None
+        if ret:
+            encoded_data = ret.content
+            formatted_response = json.loads(encoded_data)
+
+        return get_rpc_error(random_id, formatted_response, timeout_error, ErrorResponse(
+            error_message=str(error), random_id=random_id.value))
 
 
 class TCPProtocol(IProtocol):
@@ -484,7 +653,7 @@ class TCPProtocol(IProtocol):
         error = ""
         try:
             logger.info("[Client] Sending find_node RPC...")
-            ret = requests.post(
+            ret = post(
                 f"http://{self.url}:{self.port}/find_node",
                 data=encoded_data,
                 timeout=Constants.REQUEST_TIMEOUT_SEC
@@ -492,7 +661,7 @@ class TCPProtocol(IProtocol):
             logger.info(f"[Client] Received FIND_NODE response from {ret.url} with code {ret.status_code}")
 
         except (requests.Timeout, requests.ConnectionError) as t:
-            logger.error("[Client] Timeout error when contacting node.\n", t)
+            logger.error("[Client] Timeout error when contacting node: %s", t)
             timeout_error = True
             error = t
 
@@ -517,14 +686,14 @@ class TCPProtocol(IProtocol):
                     rpc_error = get_rpc_error(id,
                                               ret_decoded,
                                               timeout_error,
-                                              ErrorResponse(error_message=str(error), random_id=ID.random_id()))
+                                              ErrorResponse(error_message=str(error), random_id=id.value))
                     if contacts:
                         ret_contacts = [c for c in contacts if c.protocol is not None]
                         return ret_contacts, rpc_error
             rpc_error = get_rpc_error(id,
                                       ret_decoded,
                                       timeout_error,
-                                      ErrorResponse(error_message=str(error), random_id=ID.random_id()))
+                                      ErrorResponse(error_message=str(error), random_id=id.value))
             return [], rpc_error
         except Exception as e:
             error = RPCError()
@@ -559,7 +728,7 @@ class TCPProtocol(IProtocol):
         ret_decoded = None
         try:
             logger.info(f"[Client] Sending FIND_VALUE to http://{self.url}:{self.port}/find_value")
-            ret = requests.post(
+            ret = post(
                 url=f"http://{self.url}:{self.port}/find_value",
                 data=encoded_data,
                 timeout=Constants.REQUEST_TIMEOUT_SEC,
@@ -638,7 +807,7 @@ class TCPProtocol(IProtocol):
         ret: requests.Response | None = None
         try:
             logger.info("[Client] Sending Ping RPC...")
-            ret: requests.Response = requests.post(
+            ret: requests.Response = post(
                 url=f"http://{self.url}:{self.port}/ping",
                 data=encoded_data,
                 timeout=Constants.REQUEST_TIMEOUT_SEC
@@ -662,7 +831,7 @@ class TCPProtocol(IProtocol):
             formatted_response = pickler.decode_data(encoded_data)
 
         return get_rpc_error(random_id, formatted_response, timeout_error, ErrorResponse(
-            error_message=str(error), random_id=ID.random_id()))
+            error_message=str(error), random_id=random_id.value))
 
     def store(self,
               sender: Contact,
@@ -689,7 +858,7 @@ class TCPProtocol(IProtocol):
 
         try:
             logger.info(f"[Client] Sending STORE to http://{self.url}:{self.port}/store")
-            ret = requests.post(
+            ret = post(
                 url=f"http://{self.url}:{self.port}/store",
                 data=encoded_data,
                 timeout=Constants.REQUEST_TIMEOUT_SEC
@@ -716,4 +885,72 @@ class TCPProtocol(IProtocol):
             formatted_response = pickler.decode_data(encoded_data)
 
         return get_rpc_error(random_id, formatted_response, timeout_error, ErrorResponse(
-            error_message=str(error), random_id=ID.random_id()))
+            error_message=str(error), random_id=random_id.value))
+
+    def store_many(self,
+                   sender: Contact,
+                   key_values: list[tuple[ID, str]],
+                   is_cached=False,
+                   expiration_time_sec=0
+                   ) -> RPCError:
+        """
+        Sends the key-value pairs in STORE_MANY requests, rather than a STORE request each.
+        Peers which don't answer /store_many are sent a STORE for each pair instead.
+        """
+        return store_many_in_batches(self, sender, key_values, is_cached, expiration_time_sec)
+
+    def _send_store_many(self,
+                         sender: Contact,
+                         key_values: list[tuple[ID, str]],
+                         is_cached: bool,
+                         expiration_time_sec: int
+                         ) -> RPCError | None:
+        """
+        Sends one STORE_MANY request.
+        :return: The error, or None if the peer didn't answer it (timed out, or 404 for an unknown path).
+        """
+        random_id = ID.random_id()
+
+        encoded_data = encode_data(
+            dict(StoreManyRequest(
+                protocol=sender.protocol.encode(),
+                sender=sender.id.value,
+                key_values=[[key.value, val] for key, val in key_values],
+                is_cached=is_cached,
+                expiration_time_sec=expiration_time_sec,
+                random_id=random_id.value)))
+
+        timeout_error = False
+        error = None
+        ret = None
+
+        try:
+            logger.info(f"[Client] Sending STORE_MANY to http://{self.url}:{self.port}/store_many")
+            ret = post(
+                url=f"http://{self.url}:{self.port}/store_many",
+                data=encoded_data,
+                timeout=Constants.REQUEST_TIMEOUT_SEC
+            )
+            logger.info(f"[Client] Received STORE_MANY response from {ret.url} with code {ret.status_code}")
+
+        except (requests.Timeout, requests.ConnectionError) as t:
+            logger.error("[Client] Timeout error when contacting node.")
+            timeout_error = True
+            error = t
+
+        except Exception as e:
+            logger.error(f"Exception while trying to store many: {e}")
+            # request timed out.
+            timeout_error = False
+            error = e
+
+        if timeout_error or (ret is not None and ret.status_code == 404):
+            return None
+
+        formatted_response = None
+        if ret:
+            encoded_data = ret.content
+            formatted_response = pickler.decode_data(encoded_data)
+
+        return get_rpc_error(random_id, formatted_response, timeout_error, ErrorResponse(
+            error_message=str(error), random_id=random_id.value))
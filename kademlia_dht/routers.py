@@ -1,12 +1,13 @@
 import copy
 import logging
-import threading
+import queue
 from abc import abstractmethod
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import datetime
-from time import sleep
 from typing import Callable, Optional
 
-import kademlia_dht.my_queues as my_queues
+from kademlia_dht import helpers
 from kademlia_dht.buckets import KBucket
 from kademlia_dht.constants import Constants
 from kademlia_dht.contact import Contact
@@ -41,8 +42,10 @@ class BaseRouter:
         :param key:
         :return:
         """
-        # gets all non-empty buckets from bucket list
-        closest: KBucket = sorted(self.node.bucket_list.buckets, key=lambda b: b.high() ^ key.value)[0]
+        # filters out empty buckets and picks the closest in the same pass.
+        key_value: int = key.value
+        closest: KBucket | None = min((b for b in self.node.bucket_list.buckets if b.contacts),
+                                      key=lambda b: b.high() ^ key_value, default=None)
 
         if closest is None:
             raise NoNonEmptyBucketsError("No non-empty buckets exist.  "
@@ -50,6 +53,17 @@ class BaseRouter:
 
         return closest
 
+    @staticmethod
+    def k_closest_contacts(contacts: list[Contact], key: ID) -> list[Contact]:
+        """
+        Returns (up to) the k contacts closest to key, sorted by XOR distance.
+        :param contacts: Contacts to select from.
+        :param key: ID to measure distance to.
+        :return: List of at most k contacts, closest first.
+        """
+        indices = helpers.k_closest_indices([c.id.value for c in contacts], key.value, Constants.K)
+        return [contacts[i] for i in indices]
+
     def rpc_find_nodes(self, key: ID, contact: Contact):
         """
         Performs find nodes() on “contact”, where we are the sender, searching for “key”.
@@ -74,29 +88,23 @@ class BaseRouter:
         :param contact:
         :return:
         """
-        nodes: list[Contact] = []
-        ret_val: Optional[str] = None
-        found_by: Optional[Contact] = None
-
         other_contacts, val, error = contact.protocol.find_value(self.node.our_contact, key)
         if self.dht:
             self.dht.handle_error(error, contact)
         else:
             logger.error(f"Router: No DHT to handle possible error.\nError: {error}")
 
-        if not error or not error.has_error():
-            if other_contacts is not None:
-                for other_contact in other_contacts:
-                    nodes.append(other_contact)
-            else:
-                if val is None:
-                    raise ValueCannotBeNoneError("None values are not expected, nor supported from FIND_VALUE RPC.")
-                else:
-                    nodes.append(contact)
-                    found_by = contact
-                    ret_val = val
+        if error and error.has_error():
+            return [], None, None
 
-        return nodes, found_by, ret_val
+        # The contact doesn't have the value, but knows of contacts closer to it.
+        if other_contacts is not None:
+            return list(other_contacts), None, None
+
+        if val is None:
+            raise ValueCannotBeNoneError("None values are not expected, nor supported from FIND_VALUE RPC.")
+
+        return [contact], contact, val
 
     def _query(self,
                key: ID,
@@ -109,10 +117,9 @@ class BaseRouter:
         This ends as soon as we find a value. A FindResult object is then returned containing closer_contacts,
         found, found_by, and the value we found.
 
-        Gets nodes by performing rpc-call on the node to query, looking for “key”, if we don’t know it,
-        it is added to a list “peers_nodes”. Checking each contact in peers_nodes, we check if it is closer
-        to the key than the node_to_query, if it is, we add it to closer_contacts. We do a similar check to
-        check if it is further, and then we add it to further_contacts.
+        Gets nodes by performing rpc-call on the node to query, looking for “key”. Checking each contact
+        we don’t know yet, we check if it is closer to the key than the node_to_query, if it is, we add it
+        to closer_contacts, otherwise we add it to further_contacts.
 
         :param key:
         :param nodes_to_query:
@@ -155,7 +162,8 @@ class BaseRouter:
         :param bucket: bucket to look in.
         :return: sorted list of contacts by distance (sorted by XOR distance to parameter key)
         """
-        return sorted(bucket.contacts, key=lambda c: c.id ^ key)
+        key_value: int = key.value
+        return sorted(bucket.contacts, key=lambda c: c.id.value ^ key_value)
 
     def get_closer_nodes(self,
                          key: ID,
@@ -167,10 +175,9 @@ class BaseRouter:
         """
         Gets nodes that are closer to “key” than “node_to_query”.
 
-        Gets nodes by performing rpc-call on the node to query, looking for “key”, if we don’t know it,
-        it is added to a list “peers_nodes”. Checking each contact in peers_nodes, we check if it is closer
-        to the key than the node_to_query, if it is, we add it to closer_contacts. We do a similar check to
-        check if it is further, and then we add it to further_contacts.
+        Gets nodes by performing rpc-call on the node to query, looking for “key”. Checking each contact
+        we don’t know yet, we check if it is closer to the key than the node_to_query, if it is, we add it
+        to closer_contacts, otherwise we add it to further_contacts.
 
         :param key:
         :param node_to_query:
@@ -180,25 +187,26 @@ class BaseRouter:
         :return:
         """
         contacts, found_by, val = rpc_call(key, node_to_query)
-        peers_nodes: list[Contact] = []
-        for contact in contacts:
-            if contact.id.value not in [self.node.our_contact.id.value, node_to_query.id.value]:
-                if contact not in [closer_contacts, further_contacts]:
-                    peers_nodes.append(contact)
-
-        nearest_node_distance = node_to_query.id ^ key
+        closer_ids: set[int] = {c.id.value for c in closer_contacts}
+        further_ids: set[int] = {c.id.value for c in further_contacts}
+        our_id_value: int = self.node.our_contact.id.value
+        query_id_value: int = node_to_query.id.value
+        nearest_node_distance: int = query_id_value ^ key.value
 
         # lock (locker)
-        close_peer_nodes = [p for p in peers_nodes if (p.id ^ node_to_query.id) < nearest_node_distance]
-        for p in close_peer_nodes:
-            if p.id not in [c.id for c in closer_contacts]:
-                closer_contacts.append(p)
-
-        # lock (locker)
-        far_peer_nodes = [p for p in peers_nodes if (p.id ^ node_to_query.id) >= nearest_node_distance]
-        for p in far_peer_nodes:
-            if p.id not in [c.id for c in further_contacts]:
-                further_contacts.append(p)
+        # Peers we don't know yet (other than us and the node we queried) go to closer_contacts if they are
+        # closer, and to further_contacts otherwise, in a single pass.
+        for contact in contacts:
+            contact_id_value: int = contact.id.value
+            if (contact_id_value == our_id_value or contact_id_value == query_id_value
+                    or contact_id_value in closer_ids or contact_id_value in further_ids):
+                continue
+            if (contact_id_value ^ query_id_value) < nearest_node_distance:
+                closer_ids.add(contact_id_value)
+                closer_contacts.append(contact)
+            else:
+                further_ids.add(contact_id_value)
+                further_contacts.append(contact)
 
         return val is not None, val, found_by, closer_contacts, further_contacts
 
@@ -230,7 +238,7 @@ class Router(BaseRouter):
         :param give_me_all: If all contacts should be returned or not - for testing purposes mainly.
         :return: returns query result.
         """
-        contacted_nodes = []
+        contacted_ids: set[int] = set()
 
         if Constants.DEBUG:
             all_nodes: list[Contact] = self.node.bucket_list.get_kbucket(key).contacts[0:Constants.K]
@@ -244,21 +252,20 @@ class Router(BaseRouter):
         # Also not explicitly in spec:
         # Any closer node in the alpha list is immediately added to our closer contact list
         # and any further node in the alpha list is immediately added to our further contact list.
-        for n in nodes_to_query:
-            if (n.id ^ key) < (self.node.our_contact.id ^ key):
-                self.closer_contacts.append(n)
+        # The remaining contacts not tested yet are put in the further contact list.
+        # We're about to contact the alpha nodes, so their IDs are also added to contacted_ids.
+        key_value: int = key.value
+        our_distance: int = self.node.our_contact.id.value ^ key_value
+        for i, n in enumerate(all_nodes):
+            if i < Constants.A:
+                if (n.id.value ^ key_value) < our_distance:
+                    self.closer_contacts.append(n)
+                else:
+                    self.further_contacts.append(n)
+                contacted_ids.add(n.id.value)
             else:
                 self.further_contacts.append(n)
 
-        # The remaining contacts not tested yet can be put here.
-        for n in all_nodes[Constants.A + 1:]:
-            self.further_contacts.append(n)
-
-        # We're about to contact these nodes.
-        for n in nodes_to_query:
-            if n.id not in [i.id for i in contacted_nodes]:
-                contacted_nodes.append(n)
-
         # Spec: The initiator then sends parallel, async FIND_NODE RPCs to the "a" nodes it has chosen,
         # "a" is a system-wide parameter, such as 3.
 
@@ -268,22 +275,21 @@ class Router(BaseRouter):
         if query_result["found"]:
             return query_result
 
-        # Add any new closer contacts to the list we're going to return.
-        ret: list[Contact] = []
-        for c in self.closer_contacts:
-            if c.id not in [i.id for i in ret]:
-                ret.append(c)
-
+        # The closer contacts are what we're going to return, get_closer_nodes keeps them free of duplicates.
         # Spec: The lookup terminates when the initiator has queried and received responses from the k closest nodes
         # it has seen.
+        # The contacts lists are only ever appended to, so the uncontacted ones are queued up as they appear
+        # rather than filtering both lists again every iteration.
+        closer_uncontacted_nodes: deque[Contact] = deque()
+        further_uncontacted_nodes: deque[Contact] = deque()
+        closer_seen = further_seen = 0
         have_work = True
-        while len(ret) < Constants.K and have_work:
-            closer_uncontacted_nodes = [
-                i for i in self.closer_contacts if i not in contacted_nodes
-            ]
-            further_uncontacted_nodes = [
-                i for i in self.further_contacts if i not in contacted_nodes
-            ]
+        while len(self.closer_contacts) < Constants.K and have_work:
+            closer_uncontacted_nodes.extend(self.closer_contacts[closer_seen:])
+            further_uncontacted_nodes.extend(self.further_contacts[further_seen:])
+            closer_seen, further_seen = len(self.closer_contacts), len(self.further_contacts)
+            self._drop_contacted(closer_uncontacted_nodes, contacted_ids)
+            self._drop_contacted(further_uncontacted_nodes, contacted_ids)
 
             # If we have uncontacted nodes, we still have work to be done.
             have_closer: bool = len(closer_uncontacted_nodes) > 0
@@ -293,10 +299,7 @@ class Router(BaseRouter):
             # Spec: of the k nodes the initiator has heard of closest to the target,
             # it picks the 'a' that it has not yet queried and resends the FIND_NODE RPC to them.
             if have_closer:
-                new_nodes_to_query = closer_uncontacted_nodes[:Constants.A]
-                for c in new_nodes_to_query:
-                    if c.id not in [i.id for i in contacted_nodes]:
-                        contacted_nodes.append(c)
+                new_nodes_to_query = self._pop_uncontacted(closer_uncontacted_nodes, contacted_ids)
 
                 query_result = (self._query(key, new_nodes_to_query, rpc_call,
                                             self.closer_contacts,
@@ -306,10 +309,7 @@ class Router(BaseRouter):
                     return query_result
 
             elif have_further:
-                new_nodes_to_query = further_uncontacted_nodes[:Constants.A]
-                for c in further_uncontacted_nodes:
-                    if c not in [i.id for i in contacted_nodes]:
-                        contacted_nodes.append(c)
+                new_nodes_to_query = self._pop_uncontacted(further_uncontacted_nodes, contacted_ids)
 
                 query_result = (self._query(key, new_nodes_to_query, rpc_call,
                                             self.closer_contacts,
@@ -333,32 +333,66 @@ class Router(BaseRouter):
         # contacts, val, found, found_by
         return FindResult(
             found=False,
-            contacts=(ret if give_me_all else sorted(ret, key=lambda contact: contact.id ^ key)[:Constants.K]),
+            contacts=(list(self.closer_contacts) if give_me_all
+                      else self.k_closest_contacts(self.closer_contacts, key)),
             found_by=None,
             val=None
         )
 
+    @staticmethod
+    def _drop_contacted(uncontacted: deque[Contact], contacted_ids: set[int]) -> None:
+        """
+        Removes contacts that have been contacted since they were queued from the front of uncontacted,
+        so that uncontacted is empty only if none of it is left to contact.
+        :param uncontacted: Queue of contacts waiting to be contacted.
+        :param contacted_ids: IDs of the contacts already contacted.
+        :return:
+        """
+        while uncontacted and uncontacted[0].id.value in contacted_ids:
+            uncontacted.popleft()
+
+    @staticmethod
+    def _pop_uncontacted(uncontacted: deque[Contact], contacted_ids: set[int]) -> list[Contact]:
+        """
+        Pops up to A contacts that have not been contacted yet from the front of uncontacted,
+        and marks them as contacted.
+        :param uncontacted: Queue of contacts waiting to be contacted.
+        :param contacted_ids: IDs of the contacts already contacted.
+        :return: Contacts to query next.
+        """
+        nodes_to_query: list[Contact] = []
+        while uncontacted and len(nodes_to_query) < Constants.A:
+            contact = uncontacted.popleft()
+            if contact.id.value not in contacted_ids:
+                contacted_ids.add(contact.id.value)
+                nodes_to_query.append(contact)
+        return nodes_to_query
+
 
 class ParallelRouter(BaseRouter):
     def __init__(self, node: Node = None):
         super().__init__(node)
-        self.__contact_queue = my_queues.InfiniteLinearQueue()
-        self.__semaphore = threading.Semaphore()
         self.__now: datetime = datetime.now()
-        self.__stop_work = False
-        self.__threads: list[threading.Thread] = []
-        self.__initialise_thread_pool()
+        # Threads are started by the executor as work is submitted, up to MAX_THREADS.
+        self.__executor = ThreadPoolExecutor(max_workers=Constants.MAX_THREADS)
+
+    def __getstate__(self) -> dict:
+        """
+        Thread pools cannot be pickled, so the executor is left out when the DHT is saved.
+        :return:
+        """
+        state = self.__dict__.copy()
+        del state["_ParallelRouter__executor"]  # self.__executor, after name mangling.
+        return state
 
-    def __initialise_thread_pool(self) -> None:
+    def __setstate__(self, state: dict) -> None:
         """
-        Creates and starts MAX-THREADS # of threads, which all run self.rpc-caller.
+        Restores a saved ParallelRouter, with a new executor in place of the one left out by __getstate__.
+        :param state:
         :return:
         """
-        for _ in range(Constants.MAX_THREADS):
-            thread = threading.Thread(target=self.__rpc_caller)
-            # thread.is_background = True
-            self.__threads.append(thread)
-            thread.start()
+        self.__dict__.update(state)
+        self.__executor = ThreadPoolExecutor(max_workers=Constants.MAX_THREADS)
 
     def queue_work(self,
                    key: ID,
@@ -366,64 +400,59 @@ class ParallelRouter(BaseRouter):
                    rpc_call: Callable,
                    closer_contacts: list[Contact],
                    further_contacts: list[Contact],
-                   find_result: FindResult) -> None:
+                   result_slot: queue.Queue) -> Future:
         """
-        Adds new Contact Queue Item to self.__contact-queue, all the
-        parameters listed are added. The semaphore is released at the end of
-        this function to signal that there is work available in the queue.
+        Submits a new Contact Queue Item to the thread pool, all the
+        parameters listed are added. One of the pool's threads will run
+        rpc_caller on it.
         :param key:
         :param contact:
         :param rpc_call:
         :param closer_contacts:
         :param further_contacts:
-        :param find_result:
-        :return:
+        :param result_slot: Queue of size 1 which the first value found is put in.
+        :return: Future which is done once the contact has been queried.
         """
 
-        self.__contact_queue.enqueue(
+        return self.__executor.submit(
+            self.__rpc_caller,
             ContactQueueItem(
                 key=key,
                 contact=contact,
                 rpc_call=rpc_call,
                 closer_contacts=closer_contacts,
                 further_contacts=further_contacts,
-                find_result=find_result)
+                result_slot=result_slot)
         )
 
-        self.__semaphore.release()
-
-    def __rpc_caller(self) -> None:
+    def __rpc_caller(self, item: ContactQueueItem) -> None:
         """
-        This is ran on each thread in parallel inside the Router; it is an infinite loop that
-        exists for as long as the Router is running. It will check for work from the semaphore
-         – if there is no work it will wait until there is. Once there is work it will dequeue
-         an item from the queue and get K nodes closer to “key” than “contact”, updating the
-         FindResult – this works even though it has been dequeued because python refers to
-         lists as references (for example, if you pass a list into a function, the function
-         can edit the list, and that will persist outside the function), so we can refer to
-         item[“findResult”] because the reference will persist in the “lookup” method.
+        This is ran on the Router's thread pool for each queued contact. It gets K nodes closer
+        to “key” than “contact”, updating the shared closer and further contact lists. If the value
+        is found, a FindResult is put in item[“result_slot”] – only the first one is kept, and
+        since every lookup has its own slot, late results from a finished lookup are harmless.
+        :param item: Contact queue item to process.
         :return:
         """
-        flag = True
-        while flag:  # I hate this.
-            self.__semaphore.acquire()
-            item: ContactQueueItem = self.__contact_queue.dequeue()
-            if item:
-                found, val, found_by, item["closer_contacts"], item["further_contacts"] = self.get_closer_nodes(
-                    item["key"],
-                    item["contact"],
-                    item["rpc_call"],
-                    item["closer_contacts"],
-                    item["further_contacts"]
-                )
-                if val or found_by:
-                    if not self.__stop_work:
-                        # Possible multiple "found"
-                        # lock(locker)
-                        item["find_result"]["found"] = True
-                        item["find_result"]["found_by"] = found_by
-                        item["find_result"]["val"] = val
-                        item["find_result"]["contacts"] = item["closer_contacts"]
+        # get_closer_nodes fills both lists in place, so they only need reading out of the item once.
+        closer_contacts: list[Contact] = item["closer_contacts"]
+        found, val, found_by, _, _ = self.get_closer_nodes(
+            key=item["key"],
+            node_to_query=item["contact"],
+            rpc_call=item["rpc_call"],
+            further_contacts=item["further_contacts"],
+            closer_contacts=closer_contacts
+        )
+        if val or found_by:
+            try:
+                item["result_slot"].put_nowait(FindResult(
+                    found=True,
+                    found_by=found_by,
+                    val=val,
+                    contacts=list(closer_contacts)
+                ))
+            except queue.Full:  # Another thread found it first.
+                pass
 
     def set_query_time(self) -> None:
         """
@@ -439,44 +468,23 @@ class ParallelRouter(BaseRouter):
         Returns if the time since query was triggered is longer than Constants REQUEST-TIMEOUT.
         :return:
         """
-        return (datetime.now() - self.__now).total_seconds() > Constants.REQUEST_TIMEOUT_SEC
+        return self._query_time_remaining() < 0
 
-    def __dequeue_remaining_work(self):
+    def _query_time_remaining(self) -> float:
         """
-        Dequeues everything from the contact queue.
+        Returns how many seconds are left before the query time expires, this is negative once it has.
         :return:
         """
-        dequeue_result = True
-        while dequeue_result:
-            dequeue_result = self.__contact_queue.dequeue()
+        return Constants.REQUEST_TIMEOUT_SEC - (datetime.now() - self.__now).total_seconds()
 
-    def _stop_remaining_work(self):
+    def _stop_remaining_work(self, pending: set[Future]) -> None:
         """
-        Dequeues everything from the contact queue, then sets “stop work” to True, so no more work will be done.
+        Cancels any queued work that has not started yet.
+        :param pending: Futures of the work queued by this lookup.
         :return:
         """
-        self.__dequeue_remaining_work()
-        self.__stop_work = True
-
-    @classmethod
-    def parallel_found(cls, find_result: FindResult, found_ret: FindResult) -> tuple[bool, FindResult]:
-        """
-        Overlays found-ret with find-result if find-result has a value.
-        It then returns if the overlay has been performed, and the new found_ret.
-        :param find_result:
-        :param found_ret:
-        :return:
-        """
-        # lock(locker)
-        if find_result["found"]:
-            # lock(find_result["contacts"]
-            # lock found ret
-            found_ret["found"] = True
-            found_ret["contacts"] = find_result["contacts"]
-            found_ret["found_by"] = find_result["found_by"]
-            found_ret["val"] = find_result["val"]
-
-        return find_result["found"], found_ret
+        for future in pending:
+            future.cancel()
 
     def lookup(self, key: ID, rpc_call: Callable, give_me_all: bool = False) -> FindResult:
         """
@@ -504,12 +512,11 @@ class ParallelRouter(BaseRouter):
         if not isinstance(self.node, Node):
             raise TypeError("ParallelRouter must have instance node.")
         have_work: bool = True
-        find_result: FindResult = FindResult(found=False, found_by=None, val="", contacts=[])
-        ret: list[Contact] = []
-        contacted_nodes: list[Contact] = []
+        result_slot: queue.Queue[FindResult] = queue.Queue(maxsize=1)
+        contacted_ids: set[int] = set()
         closer_contacts: list[Contact] = []
         further_contacts: list[Contact] = []
-        found_return = FindResult(found=False, found_by=None, val="", contacts=[])
+        pending: set[Future] = set()
 
         if Constants.DEBUG:
             all_nodes: list[Contact] = self.node.bucket_list.get_kbucket(key).contacts[0:Constants.K]
@@ -523,101 +530,91 @@ class ParallelRouter(BaseRouter):
         # Also not explicitly in specification:
         # any closer node in the alpha list is immediately added to our closer contact list,
         # and any further node in the alpha list is immediately added to our further contact list.
-        for c in nodes_to_query:
-            if (c.id ^ key) < (self.node.our_contact.id ^ key):
-                closer_contacts.append(c)
+        # The remaining contacts can be put in the further contact list.
+        # We're about to contact the alpha nodes, so their IDs are also added to contacted_ids.
+        key_value: int = key.value
+        our_distance: int = self.node.our_contact.id.value ^ key_value
+        for i, c in enumerate(all_nodes):
+            if i < Constants.A:
+                if (c.id.value ^ key_value) < our_distance:
+                    closer_contacts.append(c)
+                else:
+                    further_contacts.append(c)
+                contacted_ids.add(c.id.value)
             else:
                 further_contacts.append(c)
-        # the remaining contacts can be put here.
-        for c in all_nodes:
-            if c not in nodes_to_query:
-                further_contacts.append(c)
-        # we're about to contact these nodes.
-        for c in nodes_to_query:
-            if c.id not in [i.id for i in contacted_nodes]:
-                contacted_nodes.append(c)
 
         # Spec: the initiator then sends parallel asynchronous FIND_NODE RPCs to the
         # Constants.A nodes it has chosen.
         for c in nodes_to_query:
-            self.queue_work(key=key,
-                            contact=c,
-                            rpc_call=rpc_call,
-                            closer_contacts=closer_contacts,
-                            further_contacts=further_contacts,
-                            find_result=find_result)
+            pending.add(self.queue_work(key=key,
+                                        contact=c,
+                                        rpc_call=rpc_call,
+                                        closer_contacts=closer_contacts,
+                                        further_contacts=further_contacts,
+                                        result_slot=result_slot))
 
         self.set_query_time()
-        # add any new closer contacts to the list we're going to return.
-        for c in closer_contacts:
-            if c.id not in [r.id for r in ret]:
-                ret.append(c)
 
+        # The closer contacts are what we're going to return, the workers keep adding to them as RPCs complete.
         # The lookup terminates when the initiator has queried and
         # received responses from the k closest nodes it has seen.
-        while len(ret) < Constants.K and have_work:
-            sleep(Constants.RESPONSE_WAIT_TIME_MS / 1000)
-
-            found, found_return = self.parallel_found(find_result, found_return)
-            if found:
-                self._stop_remaining_work()
+        while len(closer_contacts) < Constants.K and have_work:
+            # Contacts and values only ever arrive when a queued RPC completes, so this sleeps until one does
+            # (or the query time runs out) rather than waking up on a fixed interval to check.
+            if pending:
+                _, pending = wait(pending, timeout=max(self._query_time_remaining(), 0),
+                                  return_when=FIRST_COMPLETED)
+
+            try:
+                found_return: FindResult = result_slot.get_nowait()
+                self._stop_remaining_work(pending)
                 return found_return
+            except queue.Empty:
+                pass
 
-            closer_uncontacted_nodes = [c for c in closer_contacts if c not in contacted_nodes]
-            further_uncontacted_nodes = [c for c in further_contacts if c not in contacted_nodes]
+            closer_uncontacted_nodes = [c for c in closer_contacts if c.id.value not in contacted_ids]
+            further_uncontacted_nodes = [c for c in further_contacts if c.id.value not in contacted_ids]
 
             have_closer = len(closer_uncontacted_nodes) > 0
             have_further = len(further_uncontacted_nodes) > 0
-            have_work = have_closer or have_further or not self._query_time_expired()
+            # Nothing left in flight means no more contacts can turn up.
+            have_work = have_closer or have_further or (bool(pending) and not self._query_time_expired())
 
             # for the k nodes the initiator has heard of closest to the target...
-            alpha_nodes = None
-
+            # Rather than waiting on a whole batch of alpha RPCs, a new one is queued each time one finishes,
+            # so that (up to) Constants.A are always in flight. RPCs still running after the query time
+            # has expired are treated as lost, so they do not hold on to their slot.
+            in_flight: int = 0 if self._query_time_expired() else len(pending)
+            free_slots: int = max(Constants.A - in_flight, 0)
             if have_closer:
-                # we're about to contact these nodes.
-                if len(closer_uncontacted_nodes) >= Constants.A:
-                    alpha_nodes = closer_uncontacted_nodes[0: Constants.A - 1]
-                else:
-                    alpha_nodes = closer_uncontacted_nodes
-
-                if alpha_nodes:
-                    for a in alpha_nodes:
-                        if a.id not in [c.id for c in contacted_nodes]:
-                            contacted_nodes.append(a)
-                        self.queue_work(
-                            key=key,
-                            contact=a,
-                            rpc_call=rpc_call,
-                            closer_contacts=closer_contacts,
-                            further_contacts=further_contacts,
-                            find_result=find_result
-                        )
-                self.set_query_time()
-
+                alpha_nodes = closer_uncontacted_nodes[0: free_slots]
             elif have_further:
-                if len(further_uncontacted_nodes) >= Constants.A:
-                    alpha_nodes = further_uncontacted_nodes[0: Constants.A - 1]
-                else:
-                    alpha_nodes = further_uncontacted_nodes
-
-                if alpha_nodes:
-                    for a in alpha_nodes:
-                        if a.id not in [c.id for c in contacted_nodes]:
-                            contacted_nodes.append(a)
-                        self.queue_work(
-                            key=key,
-                            contact=a,
-                            rpc_call=rpc_call,
-                            closer_contacts=closer_contacts,
-                            further_contacts=further_contacts,
-                            find_result=find_result
-                        )
+                alpha_nodes = further_uncontacted_nodes[0: free_slots]
+            else:
+                alpha_nodes = []
+
+            for a in alpha_nodes:
+                # we're about to contact these nodes.
+                contacted_ids.add(a.id.value)
+                pending.add(self.queue_work(
+                    key=key,
+                    contact=a,
+                    rpc_call=rpc_call,
+                    closer_contacts=closer_contacts,
+                    further_contacts=further_contacts,
+                    result_slot=result_slot
+                ))
+            if alpha_nodes:
                 self.set_query_time()
 
-        self._stop_remaining_work()
+        self._stop_remaining_work(pending)
+        # Each worker builds its own ID sets in get_closer_nodes, so two replies can both add the same contact.
+        # Deduplicating by ID also takes a snapshot, as RPCs still running may be adding to closer_contacts.
+        ret: list[Contact] = list({c.id.value: c for c in closer_contacts}.values())
         return FindResult(
             found=False,
-            contacts=ret if give_me_all else sorted(ret[0:Constants.K], key=lambda c: c.id ^ key),
+            contacts=ret if give_me_all else self.k_closest_contacts(ret, key),
             found_by=None,
             val=None
         )
@@ -1,11 +1,15 @@
 import json
 import logging
 import os
+import stat
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional
+from typing import Iterator, Optional
 
 from kademlia_dht import pickler
-from kademlia_dht.constants import Constants
 from kademlia_dht.dictionaries import StoreValue
 from kademlia_dht.id import ID
 from kademlia_dht.interfaces import IStorage
@@ -14,6 +18,18 @@ from kademlia_dht.interfaces import IStorage
 logger = logging.getLogger("__main__")
 
 
+def timestamp_to_datetime(timestamp: float | str) -> datetime:
+    """
+    Republish timestamps are stored as time.time() floats, a datetime is only made when one is asked for.
+    Key-value pairs saved before this were stored as ISO format strings, so they are still read.
+    :param timestamp: Seconds since the epoch, or an ISO format string.
+    :return:
+    """
+    if isinstance(timestamp, str):
+        return datetime.fromisoformat(timestamp)
+    return datetime.fromtimestamp(timestamp)
+
+
 class VirtualStorage(IStorage):
     """
     Simple storage mechanism that stores things in memory.
@@ -32,7 +48,7 @@ class VirtualStorage(IStorage):
         """
         Returns a Boolean stating whether a key-value pair exists, given key.
         """
-        return key.value in self.get_keys()
+        return key.value in self._store
 
     def get(self, key: ID | int) -> str:
         """
@@ -53,7 +69,7 @@ class VirtualStorage(IStorage):
         :param key:
         :return:
         """
-        return datetime.fromisoformat(self._store[key]["republish_timestamp"])
+        return timestamp_to_datetime(self._store[key]["republish_timestamp"])
 
     def set(self, key: ID, value: str, expiration_time_sec: int = 0) -> None:
         """
@@ -65,9 +81,8 @@ class VirtualStorage(IStorage):
         """
         self._store[key.value] = StoreValue(value=value,
                                             expiration_time=expiration_time_sec,
-                                            republish_timestamp=datetime.now().isoformat()
+                                            republish_timestamp=time.time()
                                             )
-        self.touch(key.value)
 
     def get_expiration_time_sec(self, key: int) -> int:
         """
@@ -99,7 +114,7 @@ class VirtualStorage(IStorage):
         :param key:
         :return:
         """
-        self._store[key]["republish_timestamp"] = datetime.now().isoformat()
+        self._store[key]["republish_timestamp"] = time.time()
 
     def try_get_value(self, key: ID) -> tuple[bool, str | None]:
         """
@@ -123,6 +138,10 @@ class SecondaryJSONStorage(IStorage):
         Storage object which reads/writes to a JSON file instead of to memory like how VirtualStorage does.
         the JSON is formatted as dict[int, StoreValue].
 
+        The JSON is read once, when the storage object is made, and the key-value pairs are kept in memory from
+        then on, so reads don't touch the file. Every change is written straight back to the file, unless it is
+        made inside batch().
+
         This suffers from the drawbacks of using the JSON library; it writes the entire JSON to memory to read it,
         this may lead to heap errors. TODO: Do something about this (ijson might work?)
 
@@ -132,12 +151,33 @@ class SecondaryJSONStorage(IStorage):
         :param filename: Filename to save values to - must end in .json!
         """
         self.filename = filename
+        self._make_directory()
         if not os.path.exists(self.filename):
-            cwd = os.getcwd()
-            if not os.path.exists(os.path.join(cwd, os.path.dirname(self.filename))):
-                os.mkdir(os.path.join(cwd, os.path.dirname(self.filename)))
             with open(self.filename, "w"):
                 pass  # Makes file.
+        # Held while changing self._store and writing it out, server threads can store values at the same time.
+        self._lock = threading.RLock()
+        self._store: dict[int, StoreValue] = self._load()
+        self._setup_batches()
+
+    def __getstate__(self) -> dict:
+        """
+        The storage file holds the key-value pairs, so only the filename is pickled.
+        :return:
+        """
+        return {"filename": self.filename}
+
+    def __setstate__(self, state: dict) -> None:
+        """
+        Restores a pickled storage object by reading its storage file again.
+        :param state:
+        :return:
+        """
+        self.filename = state["filename"]
+        self._make_directory()
+        self._lock = threading.RLock()
+        self._store = self._load()
+        self._setup_batches()
 
     def __repr__(self):
         return str({
@@ -151,40 +191,124 @@ class SecondaryJSONStorage(IStorage):
             "filename": self.filename
         })
 
+    def _make_directory(self) -> None:
+        """
+        Makes the directory the storage file is in, if it doesn't exist. This is only done when the storage object
+        is made or unpickled, not before every write.
+        :return:
+        """
+        directory: str = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _setup_batches(self) -> None:
+        """
+        No batch has started, and nothing is waiting to be written.
+        :return:
+        """
+        self._batch_depth: int = 0
+        self._unsaved: bool = False
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Changes made inside this (by any thread) are written to the storage file once, when the outermost batch
+        ends, rather than the whole file being written again for every change.
+        The lock isn't held for the whole batch, as callers may be making RPCs inside it.
+        :return:
+        """
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if self._batch_depth == 0 and self._unsaved:
+                    self._save()
+
+    def _changed(self) -> None:
+        """
+        Writes out a change to the key-value pairs, or leaves it for the end of the batch if one has started.
+        This should only be called with self._lock held.
+        :return:
+        """
+        if self._batch_depth:
+            self._unsaved = True
+        else:
+            self._save()
+
+    def _load(self) -> dict[int, StoreValue]:
+        """
+        Reads all key-value pairs from the storage file. JSON stores integer keys as strings, so they are
+        converted back to integers.
+        :return:
+        """
+        try:
+            with open(self.filename, "r") as f:
+                logger.debug("Load at %s", self.filename)
+                json_data: dict[str, StoreValue] = json.load(f)
+        except FileNotFoundError:
+            json_data = {}
+        except json.JSONDecodeError:  # The file is empty when it has just been made.
+            json_data = {}
+        return {int(k): v for k, v in json_data.items()}
+
+    def _save(self) -> None:
+        """
+        Writes all key-value pairs to the storage file, this should only be called with self._lock held.
+        They are written to a temporary file next to it first, which then replaces the storage file,
+        so if we die part way through writing, the old storage file is left as it was instead of half written.
+        NamedTemporaryFile makes its files readable by only us (0600), so the temporary file is given the
+        storage file's permissions before replacing it, these came from the user's umask when __init__ made it.
+        :return:
+        """
+        directory: str = os.path.dirname(self.filename)
+        self._unsaved = False
+        if not os.path.exists(self.filename):
+            # Made the same way __init__ makes it, so it gets the umask's permissions.
+            with open(self.filename, "w"):
+                pass
+        mode: int = stat.S_IMODE(os.stat(self.filename).st_mode)
+        with tempfile.NamedTemporaryFile("w", dir=directory or ".", suffix=".tmp", delete=False) as f:
+            try:
+                json.dump(self._store, f, separators=(",", ":"))
+            except BaseException:
+                f.close()
+                os.remove(f.name)
+                raise
+        os.chmod(f.name, mode)
+        os.replace(f.name, self.filename)
+
+    @staticmethod
+    def _key_value(key: ID | int) -> int:
+        """
+        Returns the integer a key-value pair is stored under, given its key as an ID or integer.
+        :param key:
+        :return:
+        """
+        if isinstance(key, ID):
+            return key.value
+        return key
+
     def set(self, key: ID, value: str | bytes, expiration_time_sec: int = 0) -> None:
         """
         Sets a key-value pair in the JSON along with the expiration time in seconds,
-        and the timestamp as the current time. The python JSON library cannot store
-        datetime objects, so it is converted in and out of “ISOFormat” which is a
-        string representation of it.
+        and the timestamp as the current time. The timestamp is stored as seconds
+        since the epoch, so it goes in and out of JSON as a plain number.
         :param key:
         :param value:
         :param expiration_time_sec:
         :return:
         """
-        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
-        with open(self.filename, "r") as f:
-            logger.info(f"Set at {self.filename}.")
-            try:
-                json_data: dict = json.load(f)
-            except json.JSONDecodeError:
-                json_data = {}
-
-        to_store: StoreValue = StoreValue(
-            value=value,
-            expiration_time=expiration_time_sec,
-            republish_timestamp=datetime.now().isoformat()
-        )
-        if key.value in json_data:
-            json_data.pop(key.value)
-
-        if str(key.value) in json_data:
-            json_data.pop(str(key.value))
-
-        json_data[key.value] = to_store
-
-        with open(self.filename, "w") as f:
-            json.dump(json_data, f)
+        with self._lock:
+            logger.info("Set at %s.", self.filename)
+            self._store[key.value] = StoreValue(
+                value=value,
+                expiration_time=expiration_time_sec,
+                republish_timestamp=time.time()
+            )
+            self._changed()
 
     def contains(self, key: ID | int) -> bool:
         """
@@ -192,19 +316,7 @@ class SecondaryJSONStorage(IStorage):
         :param key:
         :return:
         """
-        with open(self.filename, "r") as f:
-            logger.debug(f"Contains key \"{key}\" at {self.filename}")
-            f.seek(0)
-            try:
-                json_data: dict[int, StoreValue] = json.load(f)
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON decoding error in 'contains' for {self.filename}: {e}")
-                json_data = {}
-
-        if isinstance(key, ID):
-            return str(key.value) in list(json_data.keys())
-        else:
-            return str(key) in list(json_data.keys())
+        return self._key_value(key) in self._store
 
     def get_timestamp(self, key: int | ID) -> datetime:
         """
@@ -212,17 +324,7 @@ class SecondaryJSONStorage(IStorage):
         :param key:
         :return:
         """
-        with open(self.filename, "r") as f:
-            logger.debug(f"Get timestamp at {self.filename}")
-            try:
-                json_data: dict[int, StoreValue] = json.load(f)
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON decoding error in 'get_timestamp' for {self.filename}: {e}")
-                json_data = {}
-        if isinstance(key, ID):
-            return datetime.fromisoformat(json_data[key.value]["republish_timestamp"])
-        else:
-            return datetime.fromisoformat(json_data[key]["republish_timestamp"])
+        return timestamp_to_datetime(self._store[self._key_value(key)]["republish_timestamp"])
 
     def get(self, key: ID | int) -> str:
         """
@@ -230,17 +332,9 @@ class SecondaryJSONStorage(IStorage):
         :param key:
         :return:
         """
-        with open(self.filename, "r") as f:
-            f.seek(0)
-            logger.debug(f"Get at {self.filename}")
-            json_data: dict = json.load(f)
-            logger.debug("fdata", json_data)
-        if isinstance(key, ID):
-            return json_data[str(key.value)]["value"]
-        elif isinstance(key, int):
-            return json_data[str(key)]["value"]
-        else:
+        if not isinstance(key, (ID, int)):
             raise TypeError("'get()' parameter 'key' must be type ID or int.")
+        return self._store[self._key_value(key)]["value"]
 
     def get_expiration_time_sec(self, key: int) -> int:
         """
@@ -248,13 +342,7 @@ class SecondaryJSONStorage(IStorage):
         :param key:
         :return:
         """
-        with open(self.filename, "r") as f:
-            logger.debug(f"Get expiration time at {self.filename}")
-            try:
-                json_data: dict[int, StoreValue] = json.load(f)
-            except json.JSONDecodeError:
-                json_data = {}
-        return json_data[key]["expiration_time"]
+        return self._store[self._key_value(key)]["expiration_time"]
 
     def remove(self, key: int) -> None:
         """
@@ -262,31 +350,17 @@ class SecondaryJSONStorage(IStorage):
         :param key:
         :return:
         """
-        with open(self.filename, "r") as f:
-            logger.debug(f"Remove at {self.filename}")
-            try:
-                json_data: dict[str, StoreValue] = json.load(f)
-            except json.JSONDecodeError:
-                json_data = {}
-
-        if str(key) in json_data:
-            json_data.pop(str(key), None)
-
-        with open(self.filename, "w") as f:
-            json.dump(json_data, f)
+        with self._lock:
+            logger.debug("Remove at %s", self.filename)
+            if self._store.pop(self._key_value(key), None) is not None:
+                self._changed()
 
     def get_keys(self) -> list[int]:
         """
         Returns all keys stored by the storage file as a list of integers.
         :return:
         """
-        with open(self.filename, "r") as f:
-            logger.debug(f"Get keys at {self.filename}")
-            try:
-                json_data: dict[int, StoreValue] = json.load(f)
-            except json.JSONDecodeError:
-                json_data = {}
-            return list(json_data.keys())
+        return list(self._store.keys())
 
     def touch(self, key: int | ID) -> None:
         """
@@ -294,44 +368,22 @@ class SecondaryJSONStorage(IStorage):
         :param key:
         :return:
         """
-        with open(self.filename, "r") as f:
-            logger.debug(f"Touch at {self.filename}")
-            try:
-                json_data: dict[int, StoreValue] = json.load(f)
-            except json.JSONDecodeError:
-                json_data = {}
-            if isinstance(key, ID):
-                json_data[key.value]["republish_timestamp"] = datetime.now().isoformat()
-            else:
-                json_data[key]["republish_timestamp"] = datetime.now().isoformat()
-        with open(self.filename, "w") as f:
-            json.dump(json_data, f)
+        with self._lock:
+            logger.debug("Touch at %s", self.filename)
+            self._store[self._key_value(key)]["republish_timestamp"] = time.time()
+            self._changed()
 
     def try_get_value(self, key: ID) -> tuple[bool, int | str]:
-
-        with open(self.filename, "r") as f:
-            if Constants.DEBUG:
-                logger.debug(f"Try get value at {self.filename}")
-            try:
-                f.seek(0)
-                logger.debug(f"File at {self.filename}: {f.read()}")
-                f.seek(0)
-                # Key is a string because JSON library stores integers at strings
-                json_data: dict[str, StoreValue] = json.load(f)
-                logger.debug(json_data)
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON decoding error in 'try_get_value' for {self.filename}: {e}")
-                json_data = {}
-        val = None
-        ret = False
-        if str(key.value) in json_data:
-            val = json_data[str(key.value)]["value"]
-            ret = True
-        if json_data != {}:
-            with open(self.filename, "w") as f:
-                json.dump(json_data, f)
-
-        return ret, val
+        """
+        Tries to get a given value from a key-value pair, given the key. Returns True | False,
+        and the value if it was found.
+        :param key:
+        :return:
+        """
+        store_value: Optional[StoreValue] = self._store.get(key.value)
+        if store_value is None:
+            return False, None
+        return True, store_value["value"]
 
     def set_file(self, key: ID, filename: str, expiration_time_sec: int = 0) -> None:
         """
@@ -343,7 +395,7 @@ class SecondaryJSONStorage(IStorage):
         :return:
         """
         with open(filename) as f:
-            logger.debug(f"Adding data to JSON storage in{self.filename}")
+            logger.debug("Adding data to JSON storage in %s", self.filename)
             file_data = f.read()
         data_dict = {"filename": filename, "file_data": file_data}
         encoded_data_str = pickler.encode_data(data=data_dict)
@@ -2,9 +2,7 @@ import argparse
 import json
 import logging
 import os
-import pickle
 from threading import Thread
-from os.path import exists
 
 from requests import get
 from sys import stdout
@@ -21,6 +19,8 @@ from kademlia_dht.constants import Constants
 from kademlia_dht.errors import IDMismatchError
 from kademlia_dht.id import ID
 
+PUBLIC_IP_REQUEST_TIMEOUT_SEC = 3
+
 
 def handle_terminal() -> tuple[bool, int, bool]:
     parser = argparse.ArgumentParser()
@@ -66,11 +66,15 @@ def create_logger(verbose: bool) -> logging.Logger:
 
 def store_file(file_to_upload: str, dht) -> ID:
     filename = os.path.basename(file_to_upload)
-    with open(file_to_upload, "rb") as f:
-        file_contents: bytes = f.read()
-
-    # val will be a 'latin1' pickled dictionary {filename: str, file: bytes}
-    val: str = json.dumps({"filename": filename, "file": file_contents.decode(Constants.PICKLE_ENCODING)})
+    # Reading with 'latin1' maps each byte to one character, so this is the str that gets sent,
+    # without also holding the file's bytes and a decoded copy of them in memory at once.
+    with open(file_to_upload, "r", encoding=Constants.PICKLE_ENCODING, newline="") as f:
+        file_contents: str = f.read()
+
+    # val will be a JSON dictionary {filename: str, file: str ('latin1' decoded bytes)}
+    # ensure_ascii=False stops every non-ASCII byte becoming a 6 character escape, the JSON the value is sent
+    #   and stored in escapes it anyway.
+    val: str = json.dumps({"filename": filename, "file": file_contents}, ensure_ascii=False)
     del file_contents  # free up memory, file_contents could be pretty big.
 
     id_to_store_to = ID.random_id()
@@ -81,47 +85,53 @@ def store_file(file_to_upload: str, dht) -> ID:
 
 def download_file(id_to_download: ID, dht) -> str:
     found, contacts, val = dht.find_value(key=id_to_download)
-    # val will be a 'latin1' pickled dictionary {filename: str, file: bytes}
+    # val will be a JSON dictionary {filename: str, file: str ('latin1' decoded bytes)}, made by store_file()
     if not found:
         raise IDMismatchError("File ID not found on the network.")
     else:
-        # TODO: It might be a better idea to use JSON to send values.
-        val_bytes: bytes = val.encode(Constants.PICKLE_ENCODING)  # TODO: Add option for changing this in settings.
-
-        # "pickle.loads()" is very insecure and can lead to arbitrary code execution, the val received
-        #   could be maliciously crafted to allow for malicious code execution because it compiles and creates
-        #   a python object.
-        file_dict: dict = pickle.loads(val_bytes)  # TODO: Make secure.
+        try:
+            file_dict: dict = json.loads(val)
+        except json.JSONDecodeError:
+            raise TypeError("The file downloaded is formatted incorrectly.")
         if not isinstance(file_dict, dict):
             raise TypeError("The file downloaded is formatted incorrectly.")
 
-        filename: str = file_dict["filename"]
+        filename: str = file_dict.get("filename")
         if not isinstance(filename, str):
             raise TypeError("The file downloaded is formatted incorrectly.")
 
-        file_bytes: bytes = file_dict["file"]
-        if not isinstance(file_bytes, bytes):
+        file_contents: str = file_dict.get("file")
+        if not isinstance(file_contents, str):
             raise TypeError("The file downloaded is formatted incorrectly.")
 
-        del file_dict  # Free up memory.
+        del file_dict, val  # Free up memory.
 
         # get current working directory
         cwd = os.getcwd()  # TODO: Add option to change where it is installed to.
 
         install_path = os.path.join(cwd, filename)  # writes the file to the current working directory
 
-        with open(install_path, "wb") as f:
-            f.write(file_bytes)
+        with open(install_path, "w", encoding=Constants.PICKLE_ENCODING, newline="") as f:
+            f.write(file_contents)
 
         return str(install_path)
 
+
+def get_public_ip() -> str:
+    """
+    Returns our global IP from 'https://api.ipify.org', giving up after PUBLIC_IP_REQUEST_TIMEOUT_SEC
+    rather than waiting on it forever.
+    """
+    return get('https://api.ipify.org', timeout=PUBLIC_IP_REQUEST_TIMEOUT_SEC).content.decode('utf8')
+
+
 def initialise_kademlia(USE_GLOBAL_IP, PORT, logger=None) -> tuple[DHT, TCPServer, Thread]:
     if logger:
         logger.info("Initialising Kademlia.")
 
     our_id = ID.random_id()
     if USE_GLOBAL_IP:  # Port forwarding is required.
-        our_ip = get('https://api.ipify.org').content.decode('utf8')
+        our_ip = get_public_ip()
     else:
         our_ip = "127.0.0.1"
     if logger:
@@ -139,26 +149,26 @@ def initialise_kademlia(USE_GLOBAL_IP, PORT, logger=None) -> tuple[DHT, TCPServe
         url=our_ip, port=valid_port
     )
 
+    # Make directory of our_id at current working directory, before any storage is made inside it.
+    id_dir = str(our_id.value)
+    if logger:
+        logger.info(f"Making directory at {os.path.join(os.getcwd(), id_dir)}")
+    os.makedirs(id_dir, exist_ok=True)
+
     our_node = Node(
         contact=Contact(
             id=our_id,
             protocol=protocol
         ),
-        storage=SecondaryJSONStorage(f"{our_id.value}/node.json"),
+        storage=SecondaryJSONStorage(os.path.join(id_dir, "node.json")),
         cache_storage=VirtualStorage()
     )
 
-    # Make directory of our_id at current working directory.
-    create_dir_at = os.path.join(os.getcwd(), str(our_id.value))
-    logger.info(f"Making directory at {create_dir_at}")
-
-    if not exists(create_dir_at):
-        os.mkdir(create_dir_at)
     dht: DHT = DHT(
         id=our_id,
         protocol=protocol,
-        originator_storage=SecondaryJSONStorage(f"{our_id.value}/originator_storage.json"),
-        republish_storage=SecondaryJSONStorage(f"{our_id.value}/republish_storage.json"),
+        originator_storage=SecondaryJSONStorage(os.path.join(id_dir, "originator_storage.json")),
+        republish_storage=SecondaryJSONStorage(os.path.join(id_dir, "republish_storage.json")),
         cache_storage=VirtualStorage(),
         router=ParallelRouter(our_node)
     )
@@ -1,19 +1,30 @@
+import http.client
+import http.server
+import json
 import logging
 import math
 import os
 import random
 import shutil
+import socket
+import tempfile
+import threading
 import unittest
+from datetime import datetime
+from itertools import pairwise
 
 import ui_helpers
+from kademlia_dht import helpers, protocols
 from kademlia_dht.buckets import BucketList, KBucket
 from kademlia_dht.constants import Constants
 from kademlia_dht.contact import Contact
 from kademlia_dht.dht import DHT
-from kademlia_dht.errors import RPCError, TooManyContactsError
+from kademlia_dht.dictionaries import PingSubnetRequest
+from kademlia_dht.errors import NoNonEmptyBucketsError, RPCError, TooManyContactsError
 from kademlia_dht.id import ID
 from kademlia_dht.networking import TCPSubnetServer, TCPServer
 from kademlia_dht.node import Node
+from kademlia_dht.pickler import encode_data
 from kademlia_dht.protocols import TCPSubnetProtocol, VirtualProtocol
 from kademlia_dht.routers import ParallelRouter, Router
 from kademlia_dht.storage import VirtualStorage, SecondaryJSONStorage
@@ -206,6 +217,100 @@ class AddContactTest(unittest.TestCase):
             len(bucket_list.buckets[0].contacts) == 1,
             "Bucket should have one contact.")
 
+    def test_contact_exists_by_id(self):
+        """
+        Description
+
+        Checking for a contact made separately from the one in the bucket list, with the same ID.
+        Contacts from RPCs are decoded into new objects every request.
+
+        Expected
+
+        The contact should be found by its ID.
+        :return:
+        """
+        dummy_contact = Contact(ID(0), VirtualProtocol())
+        dummy_contact.protocol.node = Node(dummy_contact, VirtualStorage())
+        bucket_list: BucketList = BucketList(dummy_contact)
+
+        bucket_list.add_contact(Contact(ID(12345)))
+
+        self.assertTrue(bucket_list.contact_exists(Contact(ID(12345))),
+                        "Expected a contact with the same ID to exist.")
+        self.assertFalse(bucket_list.contact_exists(Contact(ID(54321))),
+                         "Expected a contact with a different ID not to exist.")
+
+    def test_contacts_within_distance(self):
+        """
+        Description
+
+        Adds 100 contacts, so the bucket list splits, then asks for the contacts within
+        each distance of random keys.
+
+        Expected
+
+        Every contact within the distance of the key should be returned,
+        even though other k-buckets are skipped.
+        :return:
+        """
+        # Own generator, so the global seed used by the other tests isn't moved on.
+        rng: random.Random = random.Random(1)
+        bucket_list: BucketList = BucketList(Contact(ID(rng.randrange(ID.MAX_ID))))
+        for _ in range(100):
+            bucket_list.add_contact(Contact(ID(rng.randrange(ID.MAX_ID))))
+        self.assertTrue(len(bucket_list.buckets) > 1, "Expected the bucket list to have split.")
+
+        all_id_values: list[int] = [c.id.value for c in bucket_list.contacts()]
+        for _ in range(20):
+            key: int = rng.randrange(ID.MAX_ID)
+            distance: int = bucket_list.our_id.value ^ key
+            near_id_values: list[int] = bucket_list.contacts_within_distance(key, distance)
+            self.assertTrue(
+                {v for v in all_id_values if v ^ key <= distance} <= set(near_id_values),
+                "Expected every contact within the distance to be returned."
+            )
+
+    def test_contacts_within_distance_on_boundary(self):
+        """
+        Description
+
+        Adds K contacts near 0, then one with the ID 2**159, which is the midpoint the k-bucket splits at.
+
+        Expected
+
+        The contact on the midpoint should be found when it is the key, as it goes in the k-bucket starting at 2**159.
+        :return:
+        """
+        bucket_list: BucketList = BucketList(Contact(ID(0)))
+        for i in range(1, Constants.K + 1):
+            bucket_list.add_contact(Contact(ID(i)))
+        bucket_list.add_contact(Contact(ID(2 ** 159)))
+
+        self.assertTrue(2 ** 159 in bucket_list.contacts_within_distance(2 ** 159, 0),
+                        "Expected the contact on the k-bucket boundary to be returned.")
+
+    def test_contact_exists_on_boundary(self):
+        """
+        Description
+
+        Fills a k-bucket with a contact on the midpoint 2**159 and contacts near 0, then adds one more so it splits.
+
+        Expected
+
+        split() puts the contact on the midpoint in the upper k-bucket, and contact_exists should look for it there.
+        :return:
+        """
+        bucket_list: BucketList = BucketList(Contact(ID(0)))
+        boundary_contact: Contact = Contact(ID(2 ** 159))
+        bucket_list.add_contact(boundary_contact)
+        for i in range(1, Constants.K):
+            bucket_list.add_contact(Contact(ID(i)))
+        bucket_list.add_contact(Contact(ID(Constants.K)))
+        self.assertTrue(len(bucket_list.buckets) == 2, "Expected the k-bucket to have split.")
+
+        self.assertTrue(bucket_list.contact_exists(boundary_contact),
+                        "Expected the contact on the k-bucket boundary to be found.")
+
     def test_bucket_split(self):
         """
         Description
@@ -310,6 +415,39 @@ class DHTTest(unittest.TestCase):
         self.assertTrue(return_val == "Test",
                         "Expected to get back what we stored.")
 
+    def test_stores_sent_at_once(self):
+        """
+        Description
+
+        Stores a value with 3 close contacts, whose STOREs only return once all 3 have been received.
+
+        Expected
+
+        All 3 contacts should get the value, which can only happen if the STOREs are sent at the same time.
+        :return:
+        """
+        barrier = threading.Barrier(3, timeout=5)
+
+        class WaitingProtocol(VirtualProtocol):
+            def store(self, *args, **kwargs) -> RPCError:
+                barrier.wait()  # Raises BrokenBarrierError if the others never arrive.
+                return super().store(*args, **kwargs)
+
+        vp = VirtualProtocol()
+        dht = DHT(id=ID(0), protocol=vp, storage_factory=VirtualStorage, router=Router())
+        vp.node = dht._router.node
+        other_nodes: list[Node] = []
+        for i in range(1, 4):
+            other_contact = Contact(id=ID(i), protocol=WaitingProtocol())
+            other_contact.protocol.node = Node(other_contact, VirtualStorage())
+            other_nodes.append(other_contact.protocol.node)
+            dht._router.node.bucket_list.add_contact(other_contact)
+
+        dht.store(ID(5), "Test")
+
+        for other_node in other_nodes:
+            self.assertTrue(other_node.storage.contains(ID(5)), "Expected every close contact to store the value.")
+
     def test_value_stored_in_closer_node(self):
         """
         This test creates a single contact and stores the value in that contact. We set up the IDs so that the
@@ -1013,6 +1151,29 @@ class DHTSerialisationTests(unittest.TestCase):
             "Saved and loaded DHT is not identical to the original."
         )
 
+    def test_parallel_router_serialisation(self):
+        dht: DHT = DHT(
+            id=ID.random_id(),
+            protocol=VirtualProtocol(),
+            router=ParallelRouter(),
+            storage_factory=VirtualStorage
+        )
+        dht.save("kademlia_dht/dht.pickle")
+
+        new_dht = DHT.load("kademlia_dht/dht.pickle")
+
+        self.assertTrue(
+            type(new_dht._router) == ParallelRouter,
+            f"Expected the loaded DHT to have a ParallelRouter, got {type(new_dht._router)}."
+        )
+        self.assertTrue(
+            dht.our_id == new_dht.our_id,
+            "Saved and loaded DHT is not identical to the original."
+        )
+        # The loaded router needs a working thread pool.
+        find_result = new_dht._router.lookup(ID.random_id(), new_dht._router.rpc_find_nodes)
+        self.assertFalse(find_result["found"], "Expected nothing to be found with no peers.")
+
     def test_circular_serialisation(self):
         dht: DHT = DHT(
             id=ID.random_id(),
@@ -1106,8 +1267,11 @@ class TCPSubnetTests(unittest.TestCase):
         port = 1
         while not valid_server:
             port = random.randint(10000, 10500)
-            server = TCPSubnetServer(server_address=(local_ip, port))
-            valid_server = True
+            try:
+                server = TCPSubnetServer(server_address=(local_ip, port))
+                valid_server = True
+            except OSError:  # The port is taken, e.g. by a server an earlier test left running.
+                pass
 
         p1: TCPSubnetProtocol = TCPSubnetProtocol(url=local_ip, port=port, subnet=1)
         p2: TCPSubnetProtocol = TCPSubnetProtocol(url=local_ip, port=port, subnet=2)
@@ -1127,6 +1291,17 @@ class TCPSubnetTests(unittest.TestCase):
 
         return local_ip, port, server, p1, p2, our_id, c1, c2, n1, n2, thread
 
+    def test_port_in_use(self):
+        """
+        A server that cannot bind its port should raise the OSError, not fail while cleaning up.
+        """
+        local_ip, port, server, p1, p2, our_id, c1, c2, n1, n2, thread = self.setup()
+
+        with self.assertRaises(OSError):
+            TCPSubnetServer(server_address=(local_ip, port))
+
+        server.thread_stop(thread)
+
     def test_ping_route(self):
         """
         Makes sure no exceptions are thrown when pinging a contact.
@@ -1138,6 +1313,62 @@ class TCPSubnetTests(unittest.TestCase):
 
         server.thread_stop(thread)
 
+    def test_no_response_after_stop(self):
+        """
+        Description
+        Pings a server, stops it, then pings it again over the same thread's session.
+
+        Expected
+        The connection kept alive by the first ping is closed when the server stops, so the second ping
+        should time out rather than still be answered.
+        """
+        local_ip, port, server, p1, p2, our_id, c1, c2, n1, n2, thread = self.setup()
+
+        self.assertFalse(p2.ping(c1).timeout_error, "Expected the running server to respond.")
+        server.thread_stop(thread)
+
+        self.assertTrue(p2.ping(c1).timeout_error, "Expected a stopped server not to respond.")
+
+    def test_closed_kept_alive_connection_retried(self):
+        """
+        Description
+        A server answers the first request on each connection, and closes it without answering the second,
+        like a server closing an idle kept-alive connection just as the client reuses it.
+
+        Expected
+        Both posts get a response, the second is retried on a new connection.
+        """
+        class ClosesReusedConnection(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                if getattr(self, "answered", False):
+                    self.close_connection = True
+                    return
+                self.answered = True
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ClosesReusedConnection)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/ping"
+        try:
+            first = protocols.post(url, data=b"first", timeout=Constants.REQUEST_TIMEOUT_SEC)
+            second = protocols.post(url, data=b"second", timeout=Constants.REQUEST_TIMEOUT_SEC)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        self.assertTrue(first.status_code == 200)
+        self.assertTrue(second.status_code == 200, "Expected the post to be retried on a new connection.")
+
     def test_store_route(self):
         local_ip, port, server, p1, p2, our_id, c1, c2, n1, n2, thread = self.setup()
 
@@ -1155,6 +1386,117 @@ class TCPSubnetTests(unittest.TestCase):
 
         server.thread_stop(thread)
 
+    def test_store_many_route(self):
+        local_ip, port, server, p1, p2, our_id, c1, c2, n1, n2, thread = self.setup()
+
+        key_values: list[tuple[ID, str]] = [(ID(1), "Test 1"), (ID(2), "Test 2")]
+        error: RPCError = p2.store_many(c1, key_values)
+        server.thread_stop(thread)
+
+        self.assertFalse(error.timeout_error, "Expected the peer to respond.")
+        for key, val in key_values:
+            self.assertTrue(n2.storage.contains(key), "Expected remote peer to have value.")
+            self.assertTrue(n2.storage.get(key) == val, "Expected remote peer to contain stored value.")
+
+    def test_store_many_falls_back_to_store(self):
+        """
+        Peers without /store_many answer 404, each key-value should then be sent with STORE.
+        """
+        local_ip, port, server, p1, p2, our_id, c1, c2, n1, n2, thread = self.setup()
+        server.routing_methods = {path: request_type for path, request_type in server.routing_methods.items()
+                                  if path != "/store_many"}
+
+        key_values: list[tuple[ID, str]] = [(ID(1), "Test 1"), (ID(2), "Test 2")]
+        error: RPCError = p2.store_many(c1, key_values)
+        server.thread_stop(thread)
+
+        self.assertFalse(error.timeout_error, "Expected the peer to respond.")
+        for key, val in key_values:
+            self.assertTrue(n2.storage.get(key) == val, "Expected remote peer to contain stored value.")
+
+    def test_store_many_falls_back_when_unanswered(self):
+        """
+        Peers from before STORE_MANY never answer /store_many, so the request times out.
+        Each key-value should then be sent with STORE, and the peer not reported as timed out.
+        """
+        local_ip, port, server, p1, p2, our_id, c1, c2, n1, n2, thread = self.setup()
+        released = threading.Event()
+
+        def unanswered(request):
+            released.wait(Constants.REQUEST_TIMEOUT_SEC * 4)
+            return {}
+
+        server.subnet_dispatch[p2.subnet]["/store_many"] = unanswered
+
+        key_values: list[tuple[ID, str]] = [(ID(1), "Test 1"), (ID(2), "Test 2")]
+        error: RPCError = p2.store_many(c1, key_values)
+        released.set()
+        server.thread_stop(thread)
+
+        self.assertFalse(error.timeout_error, "Expected the peer to respond to STORE.")
+        for key, val in key_values:
+            self.assertTrue(n2.storage.get(key) == val, "Expected remote peer to contain stored value.")
+
+    def test_store_many_split_up(self):
+        """
+        Description
+        Stores 3 piece sized values with STORE_MANY.
+
+        Expected
+        Each value goes in its own STORE_MANY request, so no request is bigger than a STORE of a piece.
+        """
+        local_ip, port, server, p1, p2, our_id, c1, c2, n1, n2, thread = self.setup()
+        batch_sizes: list[int] = []
+        server_store_many = server.subnet_dispatch[p2.subnet]["/store_many"]
+
+        def counting_store_many(request):
+            batch_sizes.append(len(request["key_values"]))
+            return server_store_many(request)
+
+        server.subnet_dispatch[p2.subnet]["/store_many"] = counting_store_many
+
+        key_values: list[tuple[ID, str]] = [(ID(i), str(i) * Constants.STORE_MANY_MAX_BYTES) for i in range(1, 4)]
+        error: RPCError = p2.store_many(c1, key_values)
+        server.thread_stop(thread)
+
+        self.assertFalse(error.timeout_error, "Expected the peer to respond.")
+        self.assertTrue(batch_sizes == [1, 1, 1], f"Expected a request per value, got {batch_sizes}.")
+        for key, val in key_values:
+            self.assertTrue(n2.storage.get(key) == val, "Expected remote peer to contain stored value.")
+
+    def test_split_key_values(self):
+        """
+        Batches should be cut at STORE_MANY_MAX_PAIRS pairs, or before going over STORE_MANY_MAX_BYTES of values.
+        """
+        small: list[tuple[ID, str]] = [(ID(i), "v") for i in range(Constants.STORE_MANY_MAX_PAIRS + 1)]
+        self.assertTrue([len(b) for b in protocols.split_key_values(small)] == [Constants.STORE_MANY_MAX_PAIRS, 1])
+
+        half: str = "v" * (Constants.STORE_MANY_MAX_BYTES // 2)
+        large: list[tuple[ID, str]] = [(ID(1), half), (ID(2), half), (ID(3), half + "v"), (ID(4), "v" * 10)]
+        batches = protocols.split_key_values(large)
+        self.assertTrue([len(b) for b in batches] == [2, 2])
+        self.assertTrue([kv for b in batches for kv in b] == large, "Expected the pairs to stay in order.")
+        self.assertTrue(protocols.split_key_values([]) == [])
+
+    def test_sender_contact_reused(self):
+        """
+        Repeated requests from a sender should reuse its Contact, unless its protocol changes.
+        """
+        node = Node(Contact(ID(0), TCPSubnetProtocol("127.0.0.1", 10000, 1)), VirtualStorage())
+
+        def ping_request(subnet: int) -> dict:
+            return {"protocol": TCPSubnetProtocol("127.0.0.1", 10000, subnet), "random_id": 1, "sender": 12345}
+
+        node.server_ping(ping_request(2))
+        first: Contact = node.bucket_list.contacts()[0]
+        node.server_ping(ping_request(2))
+        self.assertTrue(node.bucket_list.contacts()[0] is first, "Expected the sender's Contact to be reused.")
+
+        node.server_ping(ping_request(3))
+        moved: Contact = node.bucket_list.contacts()[0]
+        self.assertFalse(moved is first, "Expected a new Contact for a sender with a new protocol.")
+        self.assertTrue(moved.protocol.subnet == 3)
+
     def test_find_nodes_route(self):
         print()
         local_ip = "127.0.0.1"
@@ -1163,8 +1505,11 @@ class TCPSubnetTests(unittest.TestCase):
         server = None
         while not valid_server:
             port = random.randint(10000, 10500)
-            server = TCPServer(subnet_server_address=(local_ip, port))
-            valid_server = True
+            try:
+                server = TCPServer(subnet_server_address=(local_ip, port))
+                valid_server = True
+            except OSError:  # The port is taken, e.g. by a server an earlier test left running.
+                pass
 
         p1 = TCPSubnetProtocol(url=local_ip, port=port, subnet=1)
         p2 = TCPSubnetProtocol(url=local_ip, port=port, subnet=2)
@@ -1255,8 +1600,11 @@ class TCPSubnetTests(unittest.TestCase):
         port = 1
         while not valid_server:
             port = random.randint(10000, 10500)
-            server = TCPServer(subnet_server_address=(local_ip, port))
-            valid_server = True
+            try:
+                server = TCPServer(subnet_server_address=(local_ip, port))
+                valid_server = True
+            except OSError:  # The port is taken, e.g. by a server an earlier test left running.
+                pass
 
         p1 = TCPSubnetProtocol(url=local_ip, port=port, subnet=1)
         p2 = TCPSubnetProtocol(url=local_ip, port=port, subnet=2)
@@ -1286,6 +1634,173 @@ class TCPSubnetTests(unittest.TestCase):
 
         server.thread_stop(thread)
 
+    @staticmethod
+    def post(connection: http.client.HTTPConnection, path: str, body: bytes) -> tuple[http.client.HTTPResponse, bytes]:
+        """
+        Sends a raw POST request to the server, returning the response and its body.
+        """
+        connection.request("POST", path, body=body, headers={"Content-Length": str(len(body))})
+        response = connection.getresponse()
+        return response, response.read()
+
+    def test_unknown_path(self):
+        local_ip, port, server, p1, p2, our_id, c1, c2, n1, n2, thread = self.setup()
+
+        connection = http.client.HTTPConnection(local_ip, port, timeout=5)
+        response, _ = self.post(connection, "/not_a_route", b"{}")
+        connection.close()
+        server.thread_stop(thread)
+
+        self.assertEqual(response.status, 404, "Expected 404 for an unknown path.")
+        self.assertEqual(response.getheader("Connection"), "close",
+                         "Expected the connection to be closed, as the body was left unread.")
+
+    def test_undecodable_request(self):
+        local_ip, port, server, p1, p2, our_id, c1, c2, n1, n2, thread = self.setup()
+
+        connection = http.client.HTTPConnection(local_ip, port, timeout=5)
+        response, _ = self.post(connection, "/ping", b"not json")
+        # The whole body was read, so the same connection can carry on being used.
+        ping = encode_data(dict(PingSubnetRequest(
+            protocol=p2.encode(),
+            subnet=p1.subnet,
+            sender=c2.id.value,
+            random_id=ID.random_id().value
+        ))).encode(Constants.PICKLE_ENCODING)
+        next_response, _ = self.post(connection, "/ping", ping)
+        connection.close()
+        server.thread_stop(thread)
+
+        self.assertEqual(response.status, 400, "Expected 400 for an undecodable request.")
+        self.assertEqual(next_response.status, 200, "Expected the connection to still be usable afterwards.")
+
+    def test_error_response_echoes_random_id(self):
+        local_ip, port, server, p1, p2, our_id, c1, c2, n1, n2, thread = self.setup()
+
+        # Node 1 pinging itself is an error.
+        random_id = ID.random_id().value
+        ping = encode_data(dict(PingSubnetRequest(
+            protocol=p1.encode(),
+            subnet=p1.subnet,
+            sender=c1.id.value,
+            random_id=random_id
+        ))).encode(Constants.PICKLE_ENCODING)
+        connection = http.client.HTTPConnection(local_ip, port, timeout=5)
+        response, body = self.post(connection, "/ping", ping)
+        connection.close()
+        server.thread_stop(thread)
+
+        self.assertEqual(response.status, 400, "Expected 400 when a node is sent a ping from itself.")
+        self.assertEqual(json.loads(body)["random_id"], random_id,
+                         "Expected the error response to have the request's random ID.")
+
+    def test_more_connections_than_server_threads(self):
+        """
+        Idle kept-alive connections must not hold on to every server thread,
+        otherwise peers connecting afterwards time out.
+        """
+        local_ip, port, server, p1, p2, our_id, c1, c2, n1, n2, thread = self.setup()
+
+        # Each client thread has its own session, so its own connection, which it keeps open until the test ends.
+        client_count = Constants.MAX_SERVER_THREADS + 8
+        pinged = threading.Barrier(client_count + 1)
+        finished = threading.Event()
+        errors: list[RPCError] = []
+
+        def client():
+            errors.append(p2.ping(c1))
+            pinged.wait()
+            finished.wait()
+
+        clients = [threading.Thread(target=client) for _ in range(client_count)]
+        for client_thread in clients:
+            client_thread.start()
+        pinged.wait()
+
+        error: RPCError = p2.ping(c1)
+        finished.set()
+        for client_thread in clients:
+            client_thread.join()
+        server.thread_stop(thread)
+
+        self.assertFalse(
+            any(e.timeout_error for e in errors),
+            "Expected every client connecting at once to get a response."
+        )
+        self.assertFalse(
+            error.timeout_error,
+            "Expected a response while other clients' connections are idle."
+        )
+
+
+class PortTests(unittest.TestCase):
+    def test_valid_port_in_bounds(self):
+        port = helpers.get_valid_port(default_tried=True, lower_bound=20000, upper_bound=20100)
+        self.assertTrue(20000 <= port <= 20100, f"Expected a port between 20000 and 20100, got {port}.")
+
+    def test_no_free_port(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(("localhost", 0))
+            taken_port = sock.getsockname()[1]
+            with self.assertRaises(OSError, msg="Expected OSError when the only port in range is taken."):
+                helpers.get_valid_port(default_tried=True, lower_bound=taken_port, upper_bound=taken_port)
+
+    def test_bad_bounds(self):
+        with self.assertRaises(ValueError, msg="Expected ValueError when lower bound > upper bound."):
+            helpers.get_valid_port(lower_bound=2000, upper_bound=1000)
+
+
+class DigestCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "file.txt")
+        with open(self.filename, "wb") as f:
+            f.write(b"first content")
+
+        # Count how many times the file is actually hashed.
+        self.hash_count = 0
+        self.original_digest = helpers._sha1_file_digest
+
+        def counting_digest(*args, **kwargs):
+            self.hash_count += 1
+            return self.original_digest(*args, **kwargs)
+
+        helpers._sha1_file_digest = counting_digest
+
+    def tearDown(self):
+        helpers._sha1_file_digest = self.original_digest
+        self.directory.cleanup()
+
+    def test_unchanged_file_hit(self):
+        first = helpers.convert_file_to_key(self.filename)
+        second = helpers.convert_file_to_key(self.filename)
+        self.assertEqual(first, second, "Expected the same key for an unchanged file.")
+        self.assertEqual(self.hash_count, 1, "Expected an unchanged file to only be hashed once.")
+        self.assertEqual(first.value, helpers.get_sha1_hash(b"first content"),
+                         "Expected the key to be the file's SHA-1.")
+
+    def test_rewrite_with_preserved_mtime(self):
+        helpers.convert_file_to_key(self.filename)
+        stat = os.stat(self.filename)
+        # Same size, with the old timestamps put back afterwards, like cp -p or rsync -t would.
+        with open(self.filename, "wb") as f:
+            f.write(b"other content")
+        os.utime(self.filename, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        key = helpers.convert_file_to_key(self.filename)
+        self.assertEqual(key.value, helpers.get_sha1_hash(b"other content"),
+                         "Expected a rewritten file to be hashed again.")
+        self.assertEqual(self.hash_count, 2, "Expected the rewritten file to be hashed again.")
+
+    def test_resized_file(self):
+        helpers.convert_file_to_key(self.filename)
+        with open(self.filename, "ab") as f:
+            f.write(b" and more")
+
+        key = helpers.convert_file_to_key(self.filename)
+        self.assertEqual(key.value, helpers.get_sha1_hash(b"first content and more"),
+                         "Expected a resized file to be hashed again.")
+
 
 class JSONStorageTests(unittest.TestCase):
     def test_get_set(self):
@@ -1307,6 +1822,110 @@ class JSONStorageTests(unittest.TestCase):
         storage.remove(2)
         self.assertFalse(storage.contains(2), "Should have removed the ID.")
 
+    def test_reload(self):
+        if os.path.exists("1"):
+            shutil.rmtree("1")
+        storage = SecondaryJSONStorage(f"{ID(1)}/test_storage.json")
+        storage.set(ID(3), "Persisted")
+        storage.touch(3)
+
+        reloaded = SecondaryJSONStorage(f"{ID(1)}/test_storage.json")
+        self.assertTrue(reloaded.get_keys() == [3], f"Expected integer keys to be reloaded, got {reloaded.get_keys()}.")
+        self.assertEqual(reloaded.get(ID(3)), "Persisted")
+        self.assertTrue(reloaded.try_get_value(ID(3)) == (True, "Persisted"))
+
+    def test_save_replaces_file(self):
+        if os.path.exists("1"):
+            shutil.rmtree("1")
+        storage = SecondaryJSONStorage(f"{ID(1)}/test_storage.json")
+        storage.set(ID(6), "Saved")
+        storage.touch(6)
+
+        self.assertEqual(os.listdir(str(ID(1))), ["test_storage.json"],
+                         "Expected the temporary file written to have replaced the storage file.")
+        with open(f"{ID(1)}/test_storage.json") as f:
+            self.assertTrue(json.load(f)["6"]["value"] == "Saved")
+
+    def test_save_keeps_permissions(self):
+        """
+        The storage file should keep the permissions it was made with, rather than the temporary file's 0600.
+        """
+        if os.path.exists("1"):
+            shutil.rmtree("1")
+        storage = SecondaryJSONStorage(f"{ID(1)}/test_storage.json")
+        os.chmod(storage.filename, 0o644)
+        storage.set(ID(9), "Saved")
+        self.assertTrue(os.stat(storage.filename).st_mode & 0o777 == 0o644,
+                        f"Expected the mode to be kept, got {oct(os.stat(storage.filename).st_mode & 0o777)}.")
+
+    def test_batch(self):
+        if os.path.exists("1"):
+            shutil.rmtree("1")
+        storage = SecondaryJSONStorage(f"{ID(1)}/test_storage.json")
+        with storage.batch():
+            storage.set(ID(7), "First")
+            with storage.batch():
+                storage.set(ID(8), "Second")
+            self.assertTrue(SecondaryJSONStorage(f"{ID(1)}/test_storage.json").get_keys() == [],
+                            "Expected nothing to be written before the outermost batch ends.")
+            self.assertTrue(storage.contains(8), "Expected changes to be seen inside the batch.")
+
+        reloaded = SecondaryJSONStorage(f"{ID(1)}/test_storage.json")
+        self.assertTrue(sorted(reloaded.get_keys()) == [7, 8], "Expected the batch to be written when it ends.")
+
+    def test_timestamps(self):
+        if os.path.exists("1"):
+            shutil.rmtree("1")
+        before = datetime.now()
+        storage = SecondaryJSONStorage(f"{ID(1)}/test_storage.json")
+        storage.set(ID(4), "Timestamped")
+        self.assertTrue(before <= storage.get_timestamp(4) <= datetime.now(),
+                        "Expected the timestamp to be when the value was set.")
+
+        # Storage files saved before timestamps were numbers hold them as ISO format strings.
+        with open(f"{ID(1)}/test_storage.json", "w") as f:
+            json.dump({"5": {"value": "Old", "expiration_time": 0,
+                             "republish_timestamp": "2024-01-02T03:04:05"}}, f)
+        reloaded = SecondaryJSONStorage(f"{ID(1)}/test_storage.json")
+        self.assertEqual(reloaded.get_timestamp(5), datetime(2024, 1, 2, 3, 4, 5))
+
+
+class FileTransferTests(unittest.TestCase):
+    def test_store_and_download_file(self):
+        """
+        Description
+
+        Stores a file holding every byte value, then downloads it from the same DHT.
+
+        Expected
+
+        The downloaded file should have exactly the same bytes.
+        :return:
+        """
+        vp = VirtualProtocol()
+        dht = DHT(id=ID(1), router=Router(), protocol=vp, originator_storage=VirtualStorage(),
+                  republish_storage=VirtualStorage(), cache_storage=VirtualStorage())
+        vp.node = dht._router.node
+        file_bytes: bytes = bytes(range(256)) + b"\r\n\n\r"
+
+        with tempfile.TemporaryDirectory() as directory:
+            upload_path: str = os.path.join(directory, "upload", "test_file.bin")
+            os.mkdir(os.path.dirname(upload_path))
+            with open(upload_path, "wb") as f:
+                f.write(file_bytes)
+            file_id: ID = ui_helpers.store_file(upload_path, dht)
+
+            cwd: str = os.getcwd()
+            os.chdir(directory)
+            try:
+                download_path: str = ui_helpers.download_file(file_id, dht)
+            finally:
+                os.chdir(cwd)
+
+            self.assertEqual(os.path.basename(download_path), "test_file.bin")
+            with open(download_path, "rb") as f:
+                self.assertEqual(f.read(), file_bytes, "Expected the downloaded file to match the stored file.")
+
 
 class IDIntegerTests(unittest.TestCase):
     def test_xor(self):
@@ -1384,22 +2003,20 @@ class NodeLookupTests(unittest.TestCase):
 
         # the contacts are already in ascending order with respect to the key.
         distances: list[int] = [c.id ^ key for c in closest]
-        distance: int = distances[0]
 
         # checking they're all in order (ascending)
-        for i in distances[1:]:
-            self.assertTrue(distance < i,
-                            "Expected contacts to be ordered by distance.")
-            distance = i
+        self.assertTrue(all(a < b for a, b in pairwise(distances)),
+                        "Expected contacts to be ordered by distance.")
 
         # Verify the contacts with the smallest distances have been returned from all possible distances.
         largest_close_contact = distances[-1]
 
         # This just makes sure it returned the K smallest contact ID's possible.
+        closest_set: set[Contact] = set(closest)
         others = []
         for b in node.bucket_list.buckets:
             for c in b.contacts:
-                if c not in closest and (c.id ^ key) < largest_close_contact and c.id != sender.id:
+                if c not in closest_set and (c.id ^ key) < largest_close_contact and c.id != sender.id:
                     others.append(c)
 
         self.assertTrue(
@@ -1422,16 +2039,15 @@ class NodeLookupTests(unittest.TestCase):
         nodes: list[Node] = []
 
         for i in range(Constants.K):
-            nodes.append(
-                Node(Contact(id=ID(2 ** i)), storage=VirtualStorage()))
-
-        for n in nodes:
-            # fixup protocols
-            n.our_contact.protocol = VirtualProtocol(n)
+            node = Node(Contact(id=ID(2 ** i)), storage=VirtualStorage())
+            # fixup protocol
+            node.our_contact.protocol = VirtualProtocol(node)
+            nodes.append(node)
 
             # our contacts:
-            router.node.bucket_list.add_contact(n.our_contact)
+            router.node.bucket_list.add_contact(node.our_contact)
 
+        for n in nodes:
             # each peer needs to know about the other peers
             n_other = [i for i in nodes if i is not n]  # MIGHT ERROR
             # n_other = [i for i in nodes if i != n]
@@ -1448,6 +2064,7 @@ class NodeLookupTests(unittest.TestCase):
         contacts_to_query = router.node.bucket_list.buckets[0].contacts
         closer_contacts: list[Contact] = []
         further_contacts: list[Contact] = []
+        query_ids: frozenset[int] = frozenset(c.id.value for c in contacts_to_query)
 
         for c in contacts_to_query:
             # should I read the output?
@@ -1459,15 +2076,15 @@ class NodeLookupTests(unittest.TestCase):
                                         further_contacts=further_contacts)
 
             closer_compare_arr = []
-            for contact in further_contacts:
-                if contact.id not in [i.id for i in contacts_to_query]:
+            for contact in closer_contacts:
+                if contact.id.value not in query_ids:
                     closer_compare_arr.append(contact)
 
             self.assertTrue(len(closer_compare_arr) == 0, "No new nodes expected.")
 
             further_compare_arr = []
             for contact in further_contacts:
-                if contact.id not in [i.id for i in contacts_to_query]:
+                if contact.id.value not in query_ids:
                     further_compare_arr.append(contact)
 
             self.assertTrue(len(further_compare_arr) == 0, "No new nodes expected.")
@@ -1485,7 +2102,7 @@ class NodeLookupTests(unittest.TestCase):
             self.nodes.append(node)
 
         for n in self.nodes:
-            n.our_contact.protocol = VirtualProtocol(n)  # Fix up protocols
+            # Adding to the router can ping nodes, which then add the router, so this stays in step with the loop below.
             self.router.node.bucket_list.add_contact(n.our_contact)
             for other_n in self.nodes:  # let each node know about each other node
                 if other_n != n:
@@ -1503,8 +2120,8 @@ class NodeLookupTests(unittest.TestCase):
         self.closer_contacts_alt_computation: list[Contact] = []
         self.further_contacts_alt_computation: list[Contact] = []
 
-        self.nearest_contact_node = sorted(self.contacts_to_query,
-                                           key=lambda contacts_to_query_nodes: contacts_to_query_nodes.id ^ key)[0]
+        self.nearest_contact_node = min(self.contacts_to_query,
+                                        key=lambda contacts_to_query_nodes: contacts_to_query_nodes.id ^ key)
         self.distance = self.nearest_contact_node.id ^ key
 
     def get_alt_close_and_far(self, contacts_to_query: list[Contact],
@@ -1517,10 +2134,16 @@ class NodeLookupTests(unittest.TestCase):
         """
         Alternate implementation for getting closer and further contacts.
         """
+        node_by_id: dict[int, Node] = {n.our_contact.id.value: n for n in nodes}
+        query_ids: set[int] = {c.id.value for c in contacts_to_query}
+        # Kept in step with closer and further.
+        closer_ids: set[int] = {c.id.value for c in closer}
+        further_ids: set[int] = {c.id.value for c in further}
+
         # For each node (A == K) for testing in our bucket (nodes_to_query
         for contact in contacts_to_query:
             # Find the node that we're contacting:
-            contact_node: Node = next((n for n in nodes if n.our_contact == contact), None)
+            contact_node: Node | None = node_by_id.get(contact.id.value)
             if contact_node is None:
                 continue
 
@@ -1529,39 +2152,39 @@ class NodeLookupTests(unittest.TestCase):
             # by the get_close_contacts call are contacts we're querying, so they're being excluded.
             close_contacts_of_contacted_node = [
                 c for c in contact_node.bucket_list.get_close_contacts(key, self.router.node.our_contact.id)
-                if c.id.value not in [c.id.value for c in contacts_to_query]
+                if c.id.value not in query_ids
             ]
 
             for close_contact_of_contacted_node in close_contacts_of_contacted_node:
+                close_id: int = close_contact_of_contacted_node.id.value
                 # Which of these contacts are closer?
-                if (
-                        close_contact_of_contacted_node.id.value ^ key.value < distance and close_contact_of_contacted_node.id.value not in
-                        [c.id.value for c in closer]):
+                if close_id ^ key.value < distance and close_id not in closer_ids:
                     closer.append(close_contact_of_contacted_node)
+                    closer_ids.add(close_id)
 
                 # Which of these contacts are farther?
-                if close_contact_of_contacted_node.id.value ^ key.value >= distance and close_contact_of_contacted_node.id.value not in [
-                    c.id.value for c in further]:
+                if close_id ^ key.value >= distance and close_id not in further_ids:
                     further.append(close_contact_of_contacted_node)
+                    further_ids.add(close_id)
 
-    def test_simple_all_closer_contacts(self):
-        # setup
-        # by selecting our node ID to zero, we ensure that all distances of other nodes
-        # are greater than the distance to our node.
-
-        # Create a router with the largest ID possible.
-        router = Router(Node(Contact(id=ID.max(), protocol=None), VirtualStorage()))
+    @staticmethod
+    def simple_network(router_id: ID) -> Router:
+        """
+        Makes a router with ID router_id, which knows about K nodes with IDs of powers of 2 (1 to 2**(K - 1)).
+        Each of the nodes knows about all the others.
+        :param router_id: ID of the router's node.
+        :return: The router.
+        """
+        router = Router(Node(Contact(id=router_id, protocol=None), VirtualStorage()))
         nodes: list[Node] = []
 
         for n in range(Constants.K):
             # Create a node with id of a power of 2, up to 2**20.
             node = Node(Contact(id=ID(2 ** n), protocol=None), storage=VirtualStorage())
+            # Fixup protocol
+            node.our_contact.protocol = VirtualProtocol(node)
             nodes.append(node)
 
-        # Fixup protocols
-        for n in nodes:
-            n.our_contact.protocol = VirtualProtocol(n)
-
         # add all contacts in our node list to the router.
         for n in nodes:
             router.node.bucket_list.add_contact(n.our_contact)
@@ -1570,9 +2193,19 @@ class NodeLookupTests(unittest.TestCase):
         # (add each nodes contact to each nodes bucket_list)
         for n in nodes:
             for n_other in nodes:
-                if n != n_other:
+                if n is not n_other:
                     n.bucket_list.add_contact(n_other.our_contact)
 
+        return router
+
+    def test_simple_all_closer_contacts(self):
+        # setup
+        # by selecting our node ID to zero, we ensure that all distances of other nodes
+        # are greater than the distance to our node.
+
+        # Create a router with the largest ID possible.
+        router = self.simple_network(ID.max())
+
         # select the key such that n ^ 0 == n (TODO: Why?)
         # this ensures the distance metric uses only the node ID,
         # which makes for an integer difference for distance, not an XOR distance.
@@ -1605,28 +2238,7 @@ class NodeLookupTests(unittest.TestCase):
 
         # Create a router with the smallest ID possible.
         # By selecting our node ID to zero, we ensure that all distances of other nodes are > the distance to our node.
-        router = Router(Node(Contact(id=ID(0), protocol=None), VirtualStorage()))
-        nodes: list[Node] = []
-
-        for n in range(Constants.K):
-            # Create a node with id of a power of 2, up to 2**20.
-            node = Node(Contact(id=ID(2 ** n), protocol=None), storage=VirtualStorage())
-            nodes.append(node)
-
-        # Fixup protocols
-        for n in nodes:
-            n.our_contact.protocol = VirtualProtocol(n)
-
-        # add all contacts in our node list to the router.
-        for n in nodes:
-            router.node.bucket_list.add_contact(n.our_contact)
-
-        # let all of them know where the others are:
-        # (add each nodes contact to each nodes bucket_list)
-        for n in nodes:
-            for n_other in nodes:
-                if n != n_other:
-                    n.bucket_list.add_contact(n_other.our_contact)
+        router = self.simple_network(ID(0))
 
         # select the key such that n ^ 0 == n
         # this ensures the distance metric uses only the node ID,
@@ -1651,6 +2263,126 @@ class NodeLookupTests(unittest.TestCase):
 
         self.assertTrue(len(router.closer_contacts) == 0, "Expected no closer contacts.")
 
+    @staticmethod
+    def recording_rpc_call(queried: list[int], replies: dict[int, list[Contact]]):
+        """
+        Makes an rpc_call for Router.lookup that records which contacts it is called on, and replies
+        with the contacts in replies for that contact (or no contacts).
+        :param queried: List the ID values of queried contacts are appended to.
+        :param replies: Contacts to reply with, by the ID value of the queried contact.
+        :return:
+        """
+        def rpc_call(key: ID, contact: Contact):
+            queried.append(contact.id.value)
+            return replies.get(contact.id.value, []), None, None
+
+        return rpc_call
+
+    def test_contact_after_alpha_is_queried(self):
+        """
+        The contact straight after the alpha contacts must go to the further contacts and be queried,
+        not be skipped.
+        :return:
+        """
+        original_a = Constants.A
+        Constants.A = 3
+        try:
+            router = Router(Node(Contact(id=ID.max(), protocol=None), VirtualStorage()))
+            for n in range(Constants.A + 2):
+                router.node.bucket_list.add_contact(Contact(id=ID(2 ** n), protocol=None))
+
+            key = ID(0)
+            all_nodes: list[Contact] = router.node.bucket_list.get_kbucket(key).contacts[0:Constants.K]
+            after_alpha: Contact = all_nodes[Constants.A]
+
+            queried: list[int] = []
+            router.lookup(key=key, rpc_call=self.recording_rpc_call(queried, {}), give_me_all=True)
+        finally:
+            Constants.A = original_a
+
+        self.assertTrue(after_alpha in router.further_contacts,
+                        "Expected the contact after the alpha contacts to be a further contact.")
+        self.assertTrue(sorted(queried) == sorted(c.id.value for c in all_nodes),
+                        f"Expected every contact to be queried once, got {queried}.")
+
+    def test_lookup_returns_contacts_found_in_loop(self):
+        """
+        Closer contacts found while looping over the uncontacted contacts must be in the result.
+        :return:
+        """
+        original_a = Constants.A
+        Constants.A = 1
+        try:
+            router = Router(Node(Contact(id=ID(0), protocol=None), VirtualStorage()))
+            router.node.bucket_list.add_contact(Contact(id=ID(1), protocol=None))
+            router.node.bucket_list.add_contact(Contact(id=ID(2), protocol=None))
+
+            # ID(2) is only queried in the loop, where it replies with peers closer than itself.
+            peers: list[Contact] = [Contact(id=ID(2 ** 20 + i), protocol=None) for i in range(2)]
+            queried: list[int] = []
+            find_result = router.lookup(key=ID(2 ** 159),
+                                        rpc_call=self.recording_rpc_call(queried, {2: peers}),
+                                        give_me_all=True)
+        finally:
+            Constants.A = original_a
+
+        self.assertTrue([c.id.value for c in find_result["contacts"]] == [c.id.value for c in peers],
+                        f"Expected the peers found in the loop to be returned, got {find_result['contacts']}.")
+        self.assertTrue(all(p.id.value in queried for p in peers), "Expected the closer peers to be queried.")
+
+    def test_parallel_lookup_returns_contacts_found_in_loop(self):
+        """
+        As test_lookup_returns_contacts_found_in_loop, but for the ParallelRouter.
+        :return:
+        """
+        original_a = Constants.A
+        Constants.A = 1
+        try:
+            router = ParallelRouter(Node(Contact(id=ID(0), protocol=None), VirtualStorage()))
+            router.node.bucket_list.add_contact(Contact(id=ID(1), protocol=None))
+            router.node.bucket_list.add_contact(Contact(id=ID(2), protocol=None))
+
+            peers: list[Contact] = [Contact(id=ID(2 ** 20 + i), protocol=None) for i in range(2)]
+            queried: list[int] = []
+            find_result = router.lookup(key=ID(2 ** 159),
+                                        rpc_call=self.recording_rpc_call(queried, {2: peers}),
+                                        give_me_all=True)
+        finally:
+            Constants.A = original_a
+
+        self.assertTrue(sorted(c.id.value for c in find_result["contacts"]) == [c.id.value for c in peers],
+                        f"Expected the peers found in the loop to be returned, got {find_result['contacts']}.")
+
+    def test_lookup_stops_at_k_closer_contacts(self):
+        """
+        Once K closer contacts have been found, the lookup ends without querying them.
+        :return:
+        """
+        original_a = Constants.A
+        Constants.A = 1
+        try:
+            router = Router(Node(Contact(id=ID(0), protocol=None), VirtualStorage()))
+            router.node.bucket_list.add_contact(Contact(id=ID(1), protocol=None))
+            router.node.bucket_list.add_contact(Contact(id=ID(2), protocol=None))
+
+            peers: list[Contact] = [Contact(id=ID(2 ** 20 + i), protocol=None) for i in range(Constants.K)]
+            queried: list[int] = []
+            find_result = router.lookup(key=ID(2 ** 159),
+                                        rpc_call=self.recording_rpc_call(queried, {2: peers}),
+                                        give_me_all=True)
+        finally:
+            Constants.A = original_a
+
+        self.assertTrue(len(find_result["contacts"]) == Constants.K,
+                        f"Expected K closer contacts, got {len(find_result['contacts'])}.")
+        self.assertTrue(queried == [1, 2], f"Expected only the router's own contacts to be queried, got {queried}.")
+
+    def test_no_nonempty_buckets(self):
+        router = Router(Node(Contact(id=ID.random_id(), protocol=None), VirtualStorage()))
+
+        with self.assertRaises(NoNonEmptyBucketsError):
+            router.find_closest_nonempty_kbucket(ID.random_id())
+
 
     def test_z_lookup(self):
 
@@ -1684,6 +2416,34 @@ class LargeFileTests(unittest.TestCase):
 
         dht = DHT(ID.random_id(), VirtualProtocol(), storage_factory=VirtualStorage, router=Router())
 
+    def test_from_data_file(self):
+        """
+        Description
+
+        Makes a DHT from a file two and a half pieces long.
+
+        Expected
+
+        Each of the 3 pieces should be stored under the SHA-1 of the piece.
+        :return:
+        """
+        # Own generator, so the global seed used by the other tests isn't moved on.
+        file_bytes: bytes = random.Random(2).randbytes(Constants.PIECE_LENGTH * 5 // 2)
+        with tempfile.TemporaryDirectory() as directory:
+            filename: str = os.path.join(directory, "large_file.bin")
+            with open(filename, "wb") as f:
+                f.write(file_bytes)
+            dht = DHT.from_data_file(filename, VirtualProtocol(), Router(), storage_factory=VirtualStorage)
+
+        pieces: list[bytes] = [file_bytes[i:i + Constants.PIECE_LENGTH]
+                               for i in range(0, len(file_bytes), Constants.PIECE_LENGTH)]
+        self.assertTrue(len(pieces) == 3)
+        self.assertTrue(sorted(dht.originator_storage().get_keys()) == sorted(helpers.get_sha1_hash(p) for p in pieces),
+                        "Expected each piece to be stored under its hash.")
+        for piece in pieces:
+            self.assertTrue(dht.originator_storage().get(helpers.get_sha1_hash(piece)) ==
+                            piece.decode(Constants.PICKLE_ENCODING))
+
 
 if __name__ == '__main__':
     unittest.main()